@@ -2,7 +2,7 @@
 from .cubeset import SeismicCubeset
 from .crop_batch import SeismicCropBatch
 from .geometry import SeismicGeometry
-from .horizon import UnstructuredHorizon, StructuredHorizon, Horizon
+from .horizon import UnstructuredHorizon, StructuredHorizon, Horizon, HorizonIndex
 from .facies import GeoBody
 from .metrics import HorizonMetrics, GeometryMetrics, enlarge_carcass_metric, METRIC_CMAP
 from .plotters import plot_image, plot_loss
@@ -10,7 +10,6 @@ import os
 import gc
 import logging
 import random
-from copy import copy
 from glob import glob
 import psutil
 
@@ -20,10 +19,12 @@ import torch
 from tqdm.auto import tqdm
 
 from ...batchflow import Pipeline, FilesIndex
-from ...batchflow import B, V, C, D, P, R, W
+from ...batchflow import B, V, C, D, W
 from ...batchflow.models.torch import EncoderDecoder
 
 from ..cubeset import SeismicCubeset, Horizon
+from ..horizon import HorizonIndex
+from ..utils import ChunkedAccumulator3D
 from ..metrics import HorizonMetrics
 from ..plotters import plot_loss, plot_image
 
@@ -298,7 +299,7 @@ class BaseController:
 
         last_loss = np.mean(model_pipeline.v('loss_history')[-50:])
         self.log(f'Train finished; last loss is {last_loss}')
-        self.log(f'Cache size: {[len(item._cached_load.cache()) for item in dataset.geometries.values()]}')
+        self.log(f'Cache size: {[item.slide_cache.info(item.path)["items"] for item in dataset.geometries.values()]}')
 
         # Cleanup
         torch.cuda.empty_cache()
@@ -327,10 +328,9 @@ class BaseController:
             then chunks are aggregated into huge 3D array, from which the horizon surface is extracted.
             This approach is fast but very memory intensive: it is advised to use it only on small (<10GB) cubes.
 
-            If 1, then cube is split into `big` chunks, each of them is split again into `crop_shape` pieces,
-            model is used to create predictions for the latter,
-            which are aggregated into 3D array of `big` chunks size, from which the horizon surfaces are extracted.
-            At last, all of the horizons are merged into one.
+            If 1, then one grid of `crop_shape` pieces is walked along the smallest dimension by one pipeline,
+            and predictions are aggregated into 3D arrays of `big` chunks size. As soon as no more pieces touch
+            a chunk, horizon surfaces are extracted from it in background and merged to the ones already found.
             This approach is a tad slower, yet allows for finer memory control by controlling how big `big` chunks are.
             Additional parameters are:
             chunk_size : int
@@ -447,46 +447,44 @@ class BaseController:
 
     def inference_1(self, dataset, heights_range=None, orientation='i', overlap_factor=2,
                     chunk_size=100, chunk_overlap=0.2, filtering_matrix=None, filter_threshold=0, **kwargs):
-        """ Split area for inference into `big` chunks, inference on each of them, merge results. """
+        """ Walk one grid over the whole area with one pipeline, aggregate predictions in `big` chunks,
+        extract horizons from each chunk as soon as it is finished, and merge them on the go.
+        """
         _ = kwargs
         geometry = dataset.geometries[0]
         spatial_ranges, heights_range = self.make_inference_ranges(dataset, heights_range)
         config, crop_shape_grid = self.make_inference_config(orientation)
 
-        # Actual inference
+        # Grid is walked along the smallest crop axis, so that chunks along it are finished one after another
         axis = np.argmin(crop_shape_grid[:2])
-        iterator = range(spatial_ranges[axis][0], spatial_ranges[axis][1], int(chunk_size*(1 - chunk_overlap)))
-
-        horizons = []
-        for chunk in self.make_pbar(iterator, desc=f'Inference on {geometry.name}| {orientation}'):
-            current_spatial_ranges = copy(spatial_ranges)
-            current_spatial_ranges[axis] = [chunk, min(chunk + chunk_size, spatial_ranges[axis][-1])]
-
-            dataset.make_grid(dataset.indices[0], crop_shape_grid,
-                              *current_spatial_ranges, heights_range,
-                              batch_size=self.batch_size,
-                              overlap_factor=overlap_factor,
-                              filtering_matrix=filtering_matrix,
-                              filter_threshold=filter_threshold)
-
-            inference_pipeline = (self.get_inference_template() << config) << dataset
+        dataset.make_grid(dataset.indices[0], crop_shape_grid,
+                          *spatial_ranges, heights_range,
+                          batch_size=self.batch_size,
+                          overlap_factor=overlap_factor,
+                          filtering_matrix=filtering_matrix,
+                          filter_threshold=filter_threshold,
+                          order=(axis, 1 - axis, 2))
+
+        # Horizons from finished chunks are merged to the ones already found
+        horizons = HorizonIndex(mean_threshold=5.5, adjacency=3)
+        def extract_horizons(mask, origin):
+            for horizon in Horizon.from_mask(mask, geometry=geometry, shifts=origin, threshold=0.5, minsize=500):
+                horizons.merge(horizon)
+
+        accumulator = ChunkedAccumulator3D(dataset.grid_info['predict_shape'], origin=dataset.grid_info['shifts'],
+                                           axis=axis, chunk_size=chunk_size,
+                                           chunk_step=max(1, int(chunk_size*(1 - chunk_overlap))),
+                                           callback=extract_horizons, aggregation='max', fill_value=0)
+        config['accumulator'] = accumulator
+
+        inference_pipeline = (self.get_streaming_inference_template() << config) << dataset
+        try:
             inference_pipeline.run(D('size'), n_iters=dataset.grid_iters, bar=self.bar,
                                    bar_desc=f'Inference on {geometry.name} | {orientation}')
-
-            # Assemble crops together in accordance to the created grid
-            assembled_pred = dataset.assemble_crops(inference_pipeline.v('predicted_masks'),
-                                                    order=config.get('order'))
-
-            # Extract Horizon instances
-            chunk_horizons = Horizon.from_mask(assembled_pred, dataset.grid_info, threshold=0.5, minsize=50)
-            horizons.extend(chunk_horizons)
-
-            # Cleanup
-            inference_pipeline.reset('variables')
-            inference_pipeline = None
-            gc.collect()
-
-        return Horizon.merge_list(horizons, mean_threshold=5.5, adjacency=3, minsize=500)
+            accumulator.flush()
+        finally:
+            accumulator.close()
+        return list(horizons)
 
 
     def evaluate(self, n=5, add_prefix=False, dump=False, supports=50, name=''):
@@ -577,7 +575,8 @@ class BaseController:
     def load_pipeline(self):
         """ Define data loading pipeline.
 
-        Following parameters are fetched from pipeline config: `adaptive_slices`, 'grid_src' and `rebatch_threshold`.
+        Following parameters are fetched from pipeline config: `adaptive_slices`, 'grid_src', `rebatch_threshold`
+        and `n_workers`.
         """
         return (
             Pipeline()
@@ -586,26 +585,24 @@ class BaseController:
                   side_view=C('side_view', default=False),
                   adaptive_slices=C('adaptive_slices'),
                   grid_src=C('grid_src', default='quality_grid'))
-            .create_masks(dst='masks', width=C('width', default=3))
-            .mask_rebatch(src='masks', threshold=C('rebatch_threshold', default=0.1))
-            .load_cubes(dst='images')
+            .load_masked_cubes(dst=('images', 'masks'), width=C('width', default=3),
+                               threshold=C('rebatch_threshold', default=0.1), mode='q',
+                               target=C('target', default='for'), n_workers=C('n_workers', default=None))
             .adaptive_reshape(src=['images', 'masks'], shape=self.crop_shape)
-            .scale(mode='q', src='images')
         )
 
     def augmentation_pipeline(self):
-        """ Define augmentation pipeline. """
+        """ Define augmentation pipeline.
+        Flip, rotation, zoom and elastic transform are applied to the whole batch at once by `warp_batch`,
+        with independent parameters for each item.
+        """
         return (
             Pipeline()
             .transpose(src=['images', 'masks'], order=(1, 2, 0))
-            .flip(axis=1, src=['images', 'masks'], seed=P(R('uniform', 0, 1)), p=0.3)
-            .additive_noise(scale=0.005, src='images', dst='images', p=0.3)
-            .rotate(angle=P(R('uniform', -15, 15)),
-                    src=['images', 'masks'], p=0.3)
-            .scale_2d(scale=P(R('uniform', 0.85, 1.15)),
-                      src=['images', 'masks'], p=0.3)
-            .elastic_transform(alpha=P(R('uniform', 35, 45)), sigma=P(R('uniform', 4, 4.5)),
-                               src=['images', 'masks'], p=0.2)
+            .noise_batch(src='images', additive=0.005, p=0.3)
+            .warp_batch(src=['images', 'masks'], flip_axis=1, angle=(-15, 15), scale=(0.85, 1.15),
+                        alpha=(35, 45), sigma=4,
+                        p={'flip': 0.3, 'rotate': 0.3, 'scale': 0.3, 'elastic': 0.2})
             .transpose(src=['images', 'masks'], order=(2, 0, 1))
         )
 
@@ -636,28 +633,51 @@ class BaseController:
         )
 
 
-    def get_inference_template(self):
-        """ Defines inference procedure.
+    def inference_load_pipeline(self):
+        """ Define model import and data loading for inference.
 
-        Following parameters are fetched from pipeline config: `model_pipeline`, `crop_shape`, `side_view` and `order`.
+        Following parameters are fetched from pipeline config: `model_pipeline`, `crop_shape`, `side_view`,
+        `target` and `n_workers`: pass `target='threads'` to load and scale crops in parallel threads.
         """
-        inference_template = (
+        return (
             Pipeline()
-            # Initialize everything
-            .init_variable('predicted_masks', [])
             .import_model('model', C('model_pipeline'))
-
-            # Load data
             .crop(points=D('grid_gen')(), shape=self.crop_shape,
                   side_view=C('side_view', default=False))
-            .load_cubes(dst='images')
+            .load_cubes(dst='images', target=C('target', default='for'), n_workers=C('n_workers', default=None))
             .adaptive_reshape(src='images', shape=self.crop_shape)
-            .scale(mode='q', src='images')
+            .scale(mode='q', src='images', target=C('target', default='for'), n_workers=C('n_workers', default=None))
+        )
 
-            # Predict with model, then aggregate
+    def inference_predict_pipeline(self, save_to):
+        """ Define prediction on loaded crops for inference, with results saved to `save_to`. """
+        return (
+            Pipeline()
             .predict_model('model',
                            B('images'),
                            fetches='predictions',
-                           save_to=V('predicted_masks', mode='e'))
+                           save_to=save_to)
+        )
+
+    def get_inference_template(self):
+        """ Defines inference procedure: predictions are stored in the `predicted_masks` pipeline variable.
+        Parameters of :meth:`.inference_load_pipeline` are fetched from pipeline config.
+        """
+        inference_template = (
+            Pipeline().init_variable('predicted_masks', []) +
+            self.inference_load_pipeline() +
+            self.inference_predict_pipeline(save_to=V('predicted_masks', mode='e'))
+        )
+        return inference_template
+
+    def get_streaming_inference_template(self):
+        """ Defines inference procedure, that adds predictions to the accumulator instead of storing them.
+        Parameters of :meth:`.inference_load_pipeline`, `order` and `accumulator` are fetched from pipeline config.
+        """
+        inference_template = (
+            self.inference_load_pipeline() +
+            self.inference_predict_pipeline(save_to=B('predicted_masks', mode='w')) +
+            Pipeline()
+            .update_accumulator(src='predicted_masks', accumulator=C('accumulator'), order=C('order'))
         )
         return inference_template
@@ -66,12 +66,10 @@ class Enhancer(BaseController):
             Pipeline()
             .crop(points=D('train_sampler')(self.batch_size),
                   shape=self.crop_shape, side_view=True)
-            .create_masks(dst='masks', width=C('width', default=3))
-            .mask_rebatch(src='masks', threshold=C('rebatch_threshold', default=0.99))
-            .load_cubes(dst='images')
+            .load_masked_cubes(dst=('images', 'masks'), width=C('width', default=3),
+                               threshold=C('rebatch_threshold', default=0.99), mode='q')
             .adaptive_reshape(src=['images', 'masks'],
                               shape=self.crop_shape)
-            .scale(mode='q', src='images')
         )
 
     def distortion_pipeline(self):
@@ -125,14 +123,11 @@ class Enhancer(BaseController):
             self.train_pipeline()
         )
 
-    def get_inference_template(self):
-        """ Defines inference pipeline. """
-        inference_template = (
+    def inference_load_pipeline(self):
+        """ Defines model import and data loading for inference: prior masks are made from the horizon. """
+        return (
             Pipeline()
-            # Init everything
-            .init_variable('predicted_masks', default=list())
             .import_model('base', C('model_pipeline'))
-            # Load data
             .crop(points=D('grid_gen')(), shape=self.crop_shape,
                   side_view=C('side_view', default=False))
             .load_cubes(dst='images')
@@ -140,14 +135,18 @@ class Enhancer(BaseController):
             .adaptive_reshape(src=['images', 'prior_masks'],
                               shape=self.crop_shape)
             .scale(mode='q', src='images')
-            # Use model for prediction
+        )
+
+    def inference_predict_pipeline(self, save_to):
+        """ Defines prediction on loaded crops and prior masks, with results saved to `save_to`. """
+        return (
+            Pipeline()
             .predict_model('base',
                            B('images'),
                            B('prior_masks'),
                            fetches='predictions',
-                           save_to=V('predicted_masks', mode='e'))
+                           save_to=save_to)
         )
-        return inference_template
 
 
 
@@ -118,7 +118,9 @@ class Extender(Enhancer):
 
 
     def get_inference_template(self):
-        """ Defines inference pipeline. """
+        """ Defines inference pipeline.
+        Following parameters are fetched from pipeline config: `model_pipeline`, `horizons_target` and `n_workers`.
+        """
         inference_template = (
             Pipeline()
             # Init everything
@@ -139,7 +141,8 @@ class Extender(Enhancer):
                            save_to=B('predicted_masks', mode='w'))
             .transpose(src='predicted_masks', order=(1, 2, 0))
             .masks_to_horizons(src='predicted_masks', threshold=0.5, minsize=16,
-                               order=L(D('orders_gen')), dst='horizons', skip_merge=True)
+                               order=L(D('orders_gen')), dst='horizons', skip_merge=True,
+                               target=C('horizons_target', default='for'), n_workers=C('n_workers', default=None))
             .update(V('predicted_horizons', mode='e'), B('horizons'))
         )
         return inference_template
@@ -1,17 +1,24 @@
 """ Seismic Crop Batch."""
+import atexit
 import string
 import random
 from copy import copy
+from functools import partial
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from multiprocessing import get_context
+from threading import Lock
 
 import numpy as np
 import cv2
 from scipy.signal import butter, lfilter, hilbert
-from scipy.ndimage import gaussian_filter1d
+from scipy.ndimage import gaussian_filter1d, gaussian_filter
+from numba import njit, prange
 
-from ..batchflow import FilesIndex, Batch, action, inbatch_parallel, SkipBatchException
+from ..batchflow import FilesIndex, DatasetIndex, Batch, action, inbatch_parallel, SkipBatchException
 from ..batchflow.batch_image import transform_actions # pylint: disable=no-name-in-module,import-error
 
-from .horizon import Horizon
+from .horizon import Horizon, HorizonIndex
 from .plotters import plot_image
 
 
@@ -21,11 +28,44 @@ SIZE_POSTFIX = 12
 SIZE_SALT = len(AFFIX) + SIZE_POSTFIX
 CHARS = string.ascii_uppercase + string.digits
 
+# Worker processes are spawned once and reused by subsequent batches
+_PROCESS_POOLS = {}
+_PROCESS_POOLS_LOCK = Lock()
+
+def _get_process_pool(n_workers=None):
+    """ Pool of spawned processes with `n_workers` workers: jit-compiled parallel kernels are not fork-safe. """
+    with _PROCESS_POOLS_LOCK:
+        if n_workers not in _PROCESS_POOLS:
+            _PROCESS_POOLS[n_workers] = ProcessPoolExecutor(max_workers=n_workers, mp_context=get_context('spawn'))
+        return _PROCESS_POOLS[n_workers]
+
+@atexit.register
+def shutdown_process_pools(wait=True):
+    """ Stop worker processes of `masks_to_horizons`. New ones are spawned, if needed again. """
+    with _PROCESS_POOLS_LOCK:
+        while _PROCESS_POOLS:
+            _, executor = _PROCESS_POOLS.popitem()
+            executor.shutdown(wait=wait)
+
 
 @transform_actions(prefix='_', suffix='_', wrapper='apply_transform')
 class SeismicCropBatch(Batch):
-    """ Batch with ability to generate 3d-crops of various shapes."""
+    """ Batch with ability to generate 3d-crops of various shapes.
+
+    Heavy actions (`load_cubes`, `create_masks`, `filter_out`, `scale`) can process items in parallel threads,
+    as reading from files and most of `numpy` and `cv2` routines release GIL: pass `target='threads'` to them,
+    and number of workers with `n_workers`: it is convenient to take it from the pipeline config,
+    `n_workers=C('n_workers')`. Reads of SEG-Y files without `memmap` are serialized by their geometries.
+    CPU-bound `masks_to_horizons` can also be run in separate processes with `target='processes'`;
+    the processes are reused between batches, and stopped by :func:`.shutdown_process_pools` or at exit.
+
+    Batches of crops, made by `crop` action, are indexed by positions of items: each of them refers to its cube
+    by an integer id in the `cube_ids` component, which points to `cube_names` of the batch.
+    Boundaries of crops are also stored as one `(batch_size, 3, 2)` array in the `bounds` component.
+    """
     components = None
+    cube_names = None
+    pooled_buffers = None
 
     def _init_component(self, *args, **kwargs):
         """ Create and preallocate a new attribute with the name ``dst`` if it
@@ -62,6 +102,7 @@ class SeismicCropBatch(Batch):
         Items in that index should point to cube location to cut crops from.
         Since we can't store multiple copies of the same string in one index (due to internal usage of dictionary),
         we need to augment those strings with random postfix, which can be removed later.
+        Batches of crops are now indexed by integer positions, so it is kept only for backward compatibility.
         """
         return path + AFFIX + ''.join(random.choice(CHARS) for _ in range(SIZE_POSTFIX))
 
@@ -98,11 +139,13 @@ class SeismicCropBatch(Batch):
     def get(self, item=None, component=None):
         """ Custom access for batch attribures.
         If `component` looks like `label` or `geometry`, then we retrieve that dictionary from
-        attached dataset and use unsalted version of `item` as key.
+        attached dataset and use name of the cube of `item` as key.
         Otherwise, we get position of `item` in the current batch and use it to index sequence-like `component`.
         """
         if sum([attribute in component for attribute in ['label', 'geom']]):
-            if isinstance(item, str) and self.has_salt(item):
+            if self.cube_names is not None and isinstance(item, (int, np.integer)):
+                item = self.cube_names[self.cube_ids[item]]
+            elif isinstance(item, str) and self.has_salt(item):
                 item = self.unsalt(item)
             res = getattr(self, component)
             if isinstance(res, dict) and item in res:
@@ -112,11 +155,24 @@ class SeismicCropBatch(Batch):
         item = self.get_pos(None, component, item)
         return super().get(item, component)
 
+    def get_pos(self, data, component, index):
+        """ Items of batches of crops are their own positions. """
+        if self.cube_names is not None and isinstance(index, (int, np.integer)):
+            return index
+        return super().get_pos(data, component, index)
+
+    @property
+    def crop_names(self):
+        """ Names of cubes for each of the crops in the batch. """
+        if self.cube_names is None:
+            return np.array([self.unsalt(item) for item in self.indices])
+        return self.cube_names[self.cube_ids]
+
 
     @action
     def crop(self, points, shape=None, direction=(0, 0, 0), side_view=False,
              adaptive_slices=False, grid_src='quality_grid', eps=3,
-             dst='locations', passdown=None, dst_points='points', dst_shapes='shapes'):
+             dst='locations', passdown=None, dst_points='points', dst_shapes='shapes', prefetch=False):
         """ Generate positions of crops. Creates new instance of `SeismicCropBatch`
         with crop positions in one of the components (`locations` by default).
 
@@ -149,12 +205,16 @@ class SeismicCropBatch(Batch):
             Components of batch to keep in the new one.
         dst_points, dst_shapes : str
             Components to put points and crop shapes in.
+        prefetch : bool
+            Whether to start loading slides for created locations into geometry caches in background threads,
+            so that they are ready by the time of `load_cubes`.
 
         Notes
         -----
-        Based on the first column of `points`, new instance of SeismicCropBatch is created.
-        In order to keep multiple references to the same cube, each index is augmented
-        with prefix of fixed length (check `salt` method for details).
+        New instance of SeismicCropBatch is indexed by positions of `points`. Cube of each crop is
+        referenced by an integer id in the `cube_ids` component: names of cubes are in the `cube_names`
+        attribute, so any of them can be accessed in constant time. Boundaries of crops are stored both as
+        lists of slices in `dst` and as one `(batch_size, 3, 2)` array in the `bounds` component.
 
         Returns
         -------
@@ -164,11 +224,11 @@ class SeismicCropBatch(Batch):
         # pylint: disable=protected-access
 
         if not hasattr(self, 'transformed'):
-            new_index = [self.salt(ix) for ix in points[:, 0]]
-            new_dict = {ix: self.index.get_fullpath(self.unsalt(ix))
-                        for ix in new_index}
-            new_batch = type(self)(FilesIndex.from_index(index=new_index, paths=new_dict, dirs=False))
+            cube_names, cube_ids = np.unique(np.asarray(points[:, 0]).astype(str), return_inverse=True)
+            new_batch = type(self)(DatasetIndex(len(points)))
             new_batch.transformed = True
+            new_batch.cube_names = cube_names.astype(object)
+            new_batch.add_components('cube_ids', cube_ids.astype(np.int32))
 
             passdown = passdown or []
             passdown = [passdown] if isinstance(passdown, str) else passdown
@@ -195,8 +255,15 @@ class SeismicCropBatch(Batch):
 
             locations = [self._make_location(point, shape, direction) for point, shape in zip(points, shapes)]
 
+        bounds = np.array([[(slc.start, slc.stop) for slc in location] for location in locations], dtype=np.int32)
         new_batch.add_components((dst_points, dst_shapes), (points, shapes))
-        new_batch.add_components(dst, locations)
+        new_batch.add_components((dst, 'bounds'), (locations, bounds))
+
+        if prefetch:
+            for cube_name in np.unique([point[0] for point in points]):
+                geometry = self.get(cube_name, 'geometries')
+                geometry.prefetch([location for point, location in zip(points, locations)
+                                   if point[0] == cube_name])
         return new_batch
 
     def _make_shapes(self, points, shape, side_view):
@@ -281,9 +348,10 @@ class SeismicCropBatch(Batch):
 
 
     @action
-    @inbatch_parallel(init='indices', post='_assemble', target='for')
-    def load_cubes(self, ix, dst, src='locations', **kwargs):
+    def load_cubes(self, dst, src='locations', buffer_pool=None, dtype=np.float32, **kwargs):
         """ Load data from cube in given positions.
+        If all of the crops have the same shape, then they are loaded directly into one contiguous
+        array of `(batch_size, *shape)` shape; otherwise, crops are loaded separately and then assembled.
 
         Parameters
         ----------
@@ -291,11 +359,65 @@ class SeismicCropBatch(Batch):
             Component of batch with positions of crops to load.
         dst : str
             Component of batch to put loaded crops in.
+        buffer_pool : BufferPool, optional
+            Pool to take batch array from. Allows to reuse memory of the batches that are no longer needed:
+            array is given back to the pool by :meth:`.release_buffers`.
+        dtype : dtype
+            Type of the batch array.
+        kwargs : dict
+            Other parameters are passed to `load_crop` method of geometries.
         """
+        shapes = {tuple(slc.stop - slc.start for slc in self.get(ix, src)) for ix in self.indices}
+        if len(shapes) > 1:
+            return self._load_cubes(dst=dst, src=src, **kwargs)
+
+        shape = (len(self), *shapes.pop())
+        buffer = self._get_buffer(buffer_pool, shape, dtype)
+        return self._load_cubes_into(dst=dst, src=src, buffer=buffer, **kwargs)
+
+    def _get_buffer(self, buffer_pool, shape, dtype):
+        """ Array from `buffer_pool`, remembered to be released by :meth:`.release_buffers`, or a new one. """
+        if buffer_pool is None:
+            return np.empty(shape, dtype=dtype)
+        buffer = buffer_pool.get(shape, dtype)
+        self.pooled_buffers = (self.pooled_buffers or []) + [(buffer_pool, buffer)]
+        return buffer
+
+    @action
+    def release_buffers(self):
+        """ Give arrays, taken from buffer pools by `load_cubes` or `load_masked_cubes`, back to their pools.
+        Must be called once the data in them is no longer needed, for example, at the end of the pipeline:
+        components of the batch, that are stored in such arrays, must not be used afterwards.
+        """
+        for buffer_pool, buffer in self.pooled_buffers or []:
+            buffer_pool.release(buffer)
+        self.pooled_buffers = None
+        return self
+
+    @inbatch_parallel(init='indices', post='_assemble', target='for')
+    def _load_cubes(self, ix, dst, src='locations', **kwargs):
+        """ Load crops of different shapes one by one. """
+        _ = dst
         geom = self.get(ix, 'geometries')
         location = self.get(ix, src)
         return geom.load_crop(location, **kwargs)
 
+    @inbatch_parallel(init='indices', post='_post_load_cubes_into', target='for')
+    def _load_cubes_into(self, ix, dst, buffer, src='locations', **kwargs):
+        """ Load each crop into its own slot of `buffer`. """
+        _ = dst
+        geom = self.get(ix, 'geometries')
+        location = self.get(ix, src)
+        geom.load_crop(location, out=buffer[self.get_pos(None, src, ix)], **kwargs)
+
+    def _post_load_cubes_into(self, results, *args, dst=None, buffer=None, **kwargs):
+        _ = args, kwargs
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        setattr(self, dst, buffer)
+        return self
+
 
     @action
     @inbatch_parallel(init='indices', post='_assemble', target='for')
@@ -330,6 +452,11 @@ class SeismicCropBatch(Batch):
         -----
         Can be run only after labels-dict is loaded into labels-component.
         """
+        _ = dst
+        return self._make_mask(ix, src=src, width=width, src_labels=src_labels, indices=indices)
+
+    def _make_mask(self, ix, src='locations', width=3, src_labels='labels', indices=-1):
+        """ Create mask of one item from its labels. """
         labels = self.get(ix, src_labels) if isinstance(src_labels, str) else src_labels
         labels = [labels] if not isinstance(labels, (tuple, list)) else labels
         check_sum = False
@@ -375,30 +502,118 @@ class SeismicCropBatch(Batch):
         _ = threshold, passdown
         pos = self.get_pos(None, src, ix)
         mask = getattr(self, src)[pos]
+        return self._mask_area(mask, axis=axis)
 
+    @staticmethod
+    def _mask_area(mask, axis=-1):
+        """ Percentage of covered area of a mask, projected along `axis`. """
         reduced = np.max(mask, axis=axis) > 0.0
         return np.sum(reduced) / np.prod(reduced.shape)
 
     def _post_mask_rebatch(self, areas, *args, src=None, passdown=None, threshold=None, **kwargs):
-        #pylint: disable=protected-access, access-member-before-definition, attribute-defined-outside-init
         _ = args, kwargs
-        new_index = [self.indices[i] for i, area in enumerate(areas) if area > threshold]
-        new_dict = {idx: self.index._paths[idx] for idx in new_index}
-        if len(new_index):
-            self.index = FilesIndex.from_index(index=new_index, paths=new_dict, dirs=False)
-        else:
+        keep = [i for i, area in enumerate(areas) if area > threshold]
+        passdown = list(set((passdown or []) + [src, 'locations']))
+        return self._keep_items(keep, passdown)
+
+    def _keep_items(self, keep, components):
+        """ Leave only items at positions `keep` in the index and `components` of the batch. """
+        #pylint: disable=protected-access, access-member-before-definition, attribute-defined-outside-init
+        if not keep:
             raise SkipBatchException
 
-        passdown = passdown or []
-        passdown.extend([src, 'locations'])
-        passdown = list(set(passdown))
+        if self.cube_names is not None:
+            self.index = DatasetIndex(len(keep))
+            components = list(set(components) | {'cube_ids', 'bounds'})
+        else:
+            new_index = [self.indices[i] for i in keep]
+            new_dict = {idx: self.index._paths[idx] for idx in new_index}
+            self.index = FilesIndex.from_index(index=new_index, paths=new_dict, dirs=False)
 
-        for compo in passdown:
-            new_data = [getattr(self, compo)[i] for i, area in enumerate(areas) if area > threshold]
+        for compo in components:
+            new_data = [getattr(self, compo)[i] for i in keep]
             setattr(self, compo, np.array(new_data))
         return self
 
 
+    @action
+    def load_masked_cubes(self, dst=('images', 'masks'), src='locations', threshold=0.1, axis=-1, width=3,
+                          src_labels='labels', indices=-1, mode='q', passdown=None, target='for', n_workers=None,
+                          buffer_pool=None, dtype=np.float32, **kwargs):
+        """ Create masks, remove items with small masks, load and scale data in one pass.
+        Does the same as the sequence of `create_masks`, `mask_rebatch`, `load_cubes` and `scale`
+        actions, but data is read only for the items that are kept in the batch. Masks are created first,
+        and then the kept crops are loaded and scaled right in their slots of one batch array.
+        Both steps can be run in parallel threads.
+
+        Parameters
+        ----------
+        dst : sequence of two str
+            Components of batch to put loaded crops and masks in.
+        src : str
+            Component of batch with positions of crops to load.
+        threshold : float
+            Minimum percentage of covered area (spatial-wise) for a mask to be kept in the batch.
+        axis : int
+            Axis to project horizon to before computing mask area.
+        width : int
+            Width of horizons on masks.
+        src_labels : str
+            Component of batch with labels dict.
+        indices : str, int or sequence of ints
+            A choice scenario of used labels per crop. Refer to `create_masks` for details.
+        mode : str or None
+            Scaling mode, passed to `scaler` method of geometries. If None, then data is not scaled.
+        passdown : sequence of str
+            Other components to filter.
+        target : str
+            If `threads`, then items are processed in parallel threads. If `for`, then one by one.
+        n_workers : int
+            Number of threads to use.
+        buffer_pool : BufferPool, optional
+            Pool to take batch array of crops from. It is given back to the pool by :meth:`.release_buffers`.
+        dtype : dtype
+            Type of the crops array.
+        kwargs : dict
+            Other parameters are passed to `load_crop` method of geometries.
+        """
+        dst_images, dst_masks = dst
+        make_mask = partial(self._make_mask, src=src, width=width, src_labels=src_labels, indices=indices)
+
+        threaded = target in ['threads', 't']
+        with ThreadPoolExecutor(max_workers=n_workers) if threaded else nullcontext() as executor:
+            map_ = executor.map if threaded else map
+            masks = list(map_(make_mask, self.indices))
+            keep = [i for i, mask in enumerate(masks) if self._mask_area(mask, axis=axis) > threshold]
+            if not keep:
+                raise SkipBatchException
+
+            masks = [masks[i] for i in keep]
+            self._keep_items(keep, list(set((passdown or []) + [src])))
+
+            shapes = {mask.shape for mask in masks}
+            if len(shapes) == 1:
+                masks = np.stack(masks)
+                shape = (len(self), *shapes.pop())
+                images = self._get_buffer(buffer_pool, shape, dtype)
+            else:
+                images, masks_ = np.empty(len(self), dtype=object), np.empty(len(self), dtype=object)
+                for i, mask in enumerate(masks):
+                    images[i], masks_[i] = np.empty(mask.shape, dtype=dtype), mask
+                masks = masks_
+
+            def load(pos, ix):
+                geom = self.get(ix, 'geometries')
+                geom.load_crop(self.get(ix, src), out=images[pos], **kwargs)
+                if mode is not None:
+                    geom.scaler(images[pos], mode, out=images[pos])
+            list(map_(load, range(len(self)), self.indices))
+
+        setattr(self, dst_images, images)
+        setattr(self, dst_masks, masks)
+        return self
+
+
     @action
     @inbatch_parallel(init='_init_component', post='_assemble', target='for')
     def filter_out(self, ix, src=None, dst=None, mode=None, expr=None, low=None, high=None,
@@ -468,9 +683,10 @@ class SeismicCropBatch(Batch):
 
 
     @action
-    @inbatch_parallel(init='indices', post='_assemble', target='for')
-    def scale(self, ix, mode, src=None, dst=None):
+    def scale(self, mode, src=None, dst=None, target='for', n_workers=None):
         """ Scale values in crop.
+        If `src` component is a float array of the whole batch (for example, made by `load_cubes`), then
+        it is scaled in place, when `dst` is the same as `src` or not provided.
 
         Parameters
         ----------
@@ -480,7 +696,34 @@ class SeismicCropBatch(Batch):
             0.01 and 0.99 quantiles.
             If `q_clip`, then data is clipped to 0.01 and 0.99 quantiles and then divided by the
             maximum of absolute values of the two.
+        target : str
+            If `threads`, then items are scaled in parallel threads. If `for`, then one by one.
+        n_workers : int
+            Number of threads to use.
         """
+        dst = dst or src
+        data = getattr(self, src)
+        if not (isinstance(data, np.ndarray) and np.issubdtype(data.dtype, np.floating)):
+            return self._scale(mode=mode, src=src, dst=dst, target=target, n_workers=n_workers)
+
+        out = data if dst == src else np.empty_like(data)
+        def scale_item(pos, ix):
+            geom = self.get(ix, 'geometries')
+            geom.scaler(data[pos], mode, out=out[pos])
+
+        if target in ['threads', 't']:
+            with ThreadPoolExecutor(max_workers=n_workers) as executor:
+                list(executor.map(scale_item, range(len(self)), self.indices))
+        else:
+            for pos, ix in enumerate(self.indices):
+                scale_item(pos, ix)
+        setattr(self, dst, out)
+        return self
+
+    @inbatch_parallel(init='indices', post='_assemble', target='for')
+    def _scale(self, ix, mode, src=None, dst=None):
+        """ Scale crops one by one. """
+        _ = dst
         pos = self.get_pos(None, src, ix)
         comp_data = getattr(self, src)[pos]
         geom = self.get(ix, 'geometries')
@@ -511,10 +754,30 @@ class SeismicCropBatch(Batch):
         return np.concatenate(result, axis=axis)
 
     @action
-    @inbatch_parallel(init='indices', target='for', post='_masks_to_horizons_post')
-    def masks_to_horizons(self, ix, src='masks', src_locations='locations', dst='predicted_labels', prefix='predict',
+    def update_accumulator(self, src, accumulator, src_locations='locations', order=None):
+        """ Add crops to :class:`.Accumulator3D` or :class:`.ChunkedAccumulator3D` at their locations.
+
+        Parameters
+        ----------
+        src : str
+            Component of batch with crops.
+        accumulator : Accumulator3D or ChunkedAccumulator3D
+            Instance to add crops to. Its `origin` must be set to the location of aggregated array in the cube.
+        src_locations : str
+            Component of batch with locations of crops.
+        order : tuple of int, optional
+            Axes-param for `transpose`-operation, applied to crops to match the cube orientation.
+        """
+        crops = getattr(self, src)
+        if order is not None:
+            crops = [np.transpose(crop, order) for crop in crops]
+        accumulator.update_batch(crops, getattr(self, src_locations))
+        return self
+
+    @action
+    def masks_to_horizons(self, src='masks', src_locations='locations', dst='predicted_labels', prefix='predict',
                           threshold=0.5, mode='mean', minsize=0, mean_threshold=2.0, adjacency=1,
-                          order=(2, 0, 1), skip_merge=False):
+                          order=(2, 0, 1), skip_merge=False, target='for', n_workers=None):
         """ Convert predicted segmentation mask to a list of Horizon instances.
 
         Parameters
@@ -524,16 +787,65 @@ class SeismicCropBatch(Batch):
         src_locations : str
             Component of batch that stores locations of crops.
         dst : str/object
-            Component of batch to store the resulting horizons.
+            Component of batch to store the resulting horizons, if `skip_merge`.
+            Otherwise, either a list or a :class:`.HorizonIndex` to merge the resulting horizons into.
+            Index keeps its state between batches, so the cost of merging does not grow with number of
+            stored horizons; merge parameters of the index are used instead of `mean_threshold` and `adjacency`.
         order : tuple of int
             Axes-param for `transpose`-operation, applied to a mask before fetching point clouds.
             Default value of (2, 0, 1) is applicable to standart pipeline with one `rotate_axes`
             applied to images-tensor.
         threshold, mode, minsize, mean_threshold, adjacency, prefix
             Passed directly to `:meth:Horizon.from_mask`.
+        target : str
+            If `processes` or `mpc`, then points of horizons are extracted from masks in separate processes,
+            which are reused by subsequent calls; only masks and points are sent between processes.
+            Otherwise, either `for` or `threads`.
+        n_workers : int
+            Number of workers to use.
         """
+        kwargs = {'src': src, 'src_locations': src_locations, 'dst': dst, 'prefix': prefix, 'threshold': threshold,
+                  'mode': mode, 'minsize': minsize, 'mean_threshold': mean_threshold, 'adjacency': adjacency,
+                  'order': order, 'skip_merge': skip_merge}
+        if target in ['processes', 'mpc', 'm']:
+            return self._masks_to_horizons_mpc(n_workers=n_workers, **kwargs)
+        return self._masks_to_horizons(target=target, n_workers=n_workers, **kwargs)
+
+    @inbatch_parallel(init='indices', target='for', post='_masks_to_horizons_post')
+    def _masks_to_horizons(self, ix, src='masks', src_locations='locations', dst='predicted_labels', prefix='predict',
+                           threshold=0.5, mode='mean', minsize=0, mean_threshold=2.0, adjacency=1,
+                           order=(2, 0, 1), skip_merge=False):
+        """ Convert mask of one item to a list of horizons. """
         _ = dst, mean_threshold, adjacency, skip_merge
+        mask, shifts = self._prepare_mask(ix, src=src, src_locations=src_locations, order=order)
+
+        geometry = self.get(ix, 'geometries')
+        horizons = Horizon.from_mask(mask, geometry=geometry, shifts=shifts, threshold=threshold,
+                                     mode=mode, minsize=minsize, prefix=prefix)
+        return horizons
 
+    def _masks_to_horizons_mpc(self, src='masks', src_locations='locations', dst='predicted_labels',
+                               prefix='predict', threshold=0.5, mode='mean', minsize=0, mean_threshold=2.0,
+                               adjacency=1, order=(2, 0, 1), skip_merge=False, n_workers=None):
+        """ Extract points of horizons in worker processes, create and merge horizons in the main one. """
+        executor = _get_process_pool(n_workers)
+        futures = []
+        for ix in self.indices:
+            mask, shifts = self._prepare_mask(ix, src=src, src_locations=src_locations, order=order)
+            futures.append(executor.submit(Horizon.mask_to_points, mask, shifts=shifts, mode=mode,
+                                           threshold=threshold, minsize=minsize))
+
+        horizons_lists = []
+        for ix, future in zip(self.indices, futures):
+            geometry = self.get(ix, 'geometries')
+            horizons = [Horizon(points, geometry, name=f'{prefix}_{i}') for i, points in future.result()]
+            horizons.sort(key=len)
+            horizons_lists.append(horizons)
+        return self._masks_to_horizons_post(horizons_lists, dst=dst, skip_merge=skip_merge,
+                                            mean_threshold=mean_threshold, adjacency=adjacency)
+
+    def _prepare_mask(self, ix, src='masks', src_locations='locations', order=(2, 0, 1)):
+        """ Transpose mask of an item to cube orientation and get its shifts in the cube. """
         # Threshold the mask, transpose and rotate the mask if needed
         pos = self.get_pos(None, src, ix)
         mask = getattr(self, src)[pos]
@@ -541,12 +853,8 @@ class SeismicCropBatch(Batch):
             order = order[pos]
         mask = np.transpose(mask, axes=order)
 
-        geometry = self.get(ix, 'geometries')
         shifts = [self.get(ix, src_locations)[k].start for k in range(3)]
-
-        horizons = Horizon.from_mask(mask, geometry=geometry, shifts=shifts, threshold=threshold,
-                                     mode=mode, minsize=minsize, prefix=prefix)
-        return horizons
+        return mask, shifts
 
 
     def _masks_to_horizons_post(self, horizons_lists, *args, dst=None, skip_merge=False,
@@ -560,24 +868,20 @@ class SeismicCropBatch(Batch):
             setattr(self, dst, [hor for hor_list in horizons_lists for hor in hor_list])
             return self
 
+        if isinstance(dst, HorizonIndex):
+            index = dst
+        else:
+            # Index of horizons from the list is made only for this batch
+            index = HorizonIndex(mean_threshold=mean_threshold, adjacency=adjacency)
+            for horizon in dst:
+                index.add(horizon)
+
         for horizons in horizons_lists:
             for horizon_candidate in horizons:
-                for horizon_target in dst:
-                    merge_code, _ = Horizon.verify_merge(horizon_target, horizon_candidate,
-                                                         mean_threshold=mean_threshold,
-                                                         adjacency=adjacency)
-                    if merge_code == 3:
-                        merged = Horizon.overlap_merge(horizon_target, horizon_candidate, inplace=True)
-                    elif merge_code == 2:
-                        merged = Horizon.adjacent_merge(horizon_target, horizon_candidate, inplace=True,
-                                                        adjacency=adjacency, mean_threshold=mean_threshold)
-                    else:
-                        merged = False
-                    if merged:
-                        break
-                else:
-                    # If a horizon can't be merged to any of the previous ones, we append it as it is
-                    dst.append(horizon_candidate)
+                index.merge(horizon_candidate)
+
+        if not isinstance(dst, HorizonIndex):
+            dst[:] = list(index)
         return self
 
 
@@ -914,6 +1218,141 @@ class SeismicCropBatch(Batch):
         return gaussian_filter1d(crop, sigma=sigma, axis=axis, order=order)
 
 
+    # Batched augmentations: whole components are transformed at once
+    @action
+    def warp_batch(self, src, dst=None, flip_axis=None, angle=None, scale=None, alpha_affine=None,
+                   alpha_persp=None, alpha=None, sigma=4, p=1.0, border='constant', seed=None):
+        """ Geometric augmentations of the first two axes of crops, applied to the whole batch at once.
+        Flip, rotation, zoom, affine and perspective transforms of each item are composed into one matrix,
+        and the elastic displacement field is added on top of it: then all the crops are resampled by one
+        jit-compiled bilinear remap. Components in `src` are transformed identically, so they can contain
+        both `images` and `masks`. Resampling is done only once, so the result is less blurry, than after
+        the same sequence of per-item augmentations, like `rotate` or `elastic_transform`.
+
+        Each of the random parameters is either a number, or a `(low, high)` range to uniformly sample
+        values for each item from. If parameter is None, then the transform is not applied.
+
+        Parameters
+        ----------
+        src : str or sequence of str
+            Components to transform. Each must be made of crops with the same first two dimensions.
+        dst : str or sequence of str
+            Components to put results in. Default is `src`.
+        flip_axis : int or None
+            Axis to flip crops along, either 0 or 1.
+        angle : number or sequence of two numbers
+            Angle of rotation, in degrees.
+        scale : number or sequence of two numbers
+            Zooming factor.
+        alpha_affine : number or sequence of two numbers
+            Maximum distance along each axis between points before and after affine transform.
+        alpha_persp : number or sequence of two numbers
+            Maximum distance along each axis between points before and after perspective transform.
+        alpha : number or sequence of two numbers
+            Maximum shift of elastic transform along each axis.
+        sigma : number
+            Smoothening factor of elastic transform. Values below 2 are treated as 2.
+        p : float or dict
+            Probability to apply each of the transforms to an item: either the same for all, or a mapping
+            from `flip`, `rotate`, `scale`, `affine`, `perspective` and `elastic` to probabilities.
+        border : str
+            If `constant`, then points outside of crops are zeros. If `reflect`, then crops are mirrored.
+        seed : int, optional
+            Seed of random generator.
+        """
+        src = [src] if isinstance(src, str) else src
+        dst = src if dst is None else ([dst] if isinstance(dst, str) else dst)
+        rng = np.random.default_rng(seed)
+        arrays = [self._stack_crops(getattr(self, component)) for component in src]
+        n, shape = len(arrays[0]), arrays[0].shape[1:3]
+
+        def draw(name, value):
+            """ Values of parameter for each item and whether the transform is applied to it. """
+            probability = p.get(name, 1.0) if isinstance(p, dict) else p
+            applied = rng.random(n) < probability if value is not None else np.zeros(n, dtype=bool)
+            value = 0 if value is None else value
+            values = rng.uniform(*value, size=n) if isinstance(value, (tuple, list)) else np.full(n, value)
+            return values, applied
+
+        # Forward transforms of `(x, y, 1)` coordinates: flip, rotate and zoom, affine, perspective
+        matrix = np.tile(np.eye(3), (n, 1, 1))
+        _, applied = draw('flip', flip_axis)
+        if applied.any():
+            flip = np.eye(3)
+            flip[1 - flip_axis, 1 - flip_axis] = -1
+            flip[1 - flip_axis, 2] = shape[flip_axis] - 1
+            matrix[applied] = flip @ matrix[applied]
+
+        angles, applied_rotate = draw('rotate', angle)
+        scales, applied_scale = draw('scale', scale)
+        angles[~applied_rotate], scales[~applied_scale] = 0, 1
+        matrix = _rotation_matrices(angles, scales, center=(shape[1] // 2, shape[0] // 2)) @ matrix
+
+        for name, value, n_points in [('affine', alpha_affine, 3), ('perspective', alpha_persp, 4)]:
+            values, applied = draw(name, value)
+            if applied.any():
+                matrix[applied] = _random_point_matrices(np.minimum(values[applied], min(shape) // 16),
+                                                         shape, n_points, rng) @ matrix[applied]
+
+        # Elastic displacement fields on a coarse grid: they are upsampled inside the remap
+        values, applied = draw('elastic', alpha)
+        if applied.any():
+            grid_scale = 4
+            fields = rng.random((n, 2, shape[0] // grid_scale, shape[1] // grid_scale), dtype=np.float32) * 2 - 1
+            # Fields are always smoothed: small `sigma` would make them a per-pixel noise otherwise
+            sigma_ = max(sigma / grid_scale, 0.5)
+            truncate = ((int(4 * sigma_) | 1) // 2) / sigma_
+            fields = gaussian_filter(fields, sigma=(0, 0, sigma_, sigma_), mode='mirror', truncate=truncate)
+            fields *= ((values / grid_scale) * applied).reshape(-1, 1, 1, 1).astype(np.float32)
+        else:
+            fields = np.zeros((n, 2, 1, 1), dtype=np.float32)
+
+        inverse = np.linalg.inv(matrix)
+        active = ~np.all(np.isclose(matrix, np.eye(3)), axis=(1, 2)) | applied
+        for array, component in zip(arrays, dst):
+            out = np.empty_like(array)
+            _warp_batch(array.reshape(*array.shape[:3], -1), inverse, fields, active, border == 'reflect',
+                        out.reshape(*array.shape[:3], -1))
+            setattr(self, component, out)
+        return self
+
+    @action
+    def noise_batch(self, src, dst=None, additive=None, multiplicative=None, p=1.0, seed=None):
+        """ Add noise to the whole component at once.
+
+        Parameters
+        ----------
+        additive : float, optional
+            Standart deviation of normal distribution of added values, centered at 0.
+        multiplicative : float, optional
+            Standart deviation of normal distribution of multipliers, centered at 1.
+        p : float
+            Probability to add noise to an item.
+        seed : int, optional
+            Seed of random generator.
+        """
+        rng = np.random.default_rng(seed)
+        array = self._stack_crops(getattr(self, src))
+        applied = (rng.random(len(array)) < p).reshape(-1, *[1] * (array.ndim - 1))
+
+        result = array.astype(np.float32)
+        if multiplicative is not None:
+            noise = rng.standard_normal(dtype=np.float32, size=array.shape)
+            result *= 1 + multiplicative * noise * applied
+        if additive is not None:
+            noise = rng.standard_normal(dtype=np.float32, size=array.shape)
+            result += additive * noise * applied
+        setattr(self, dst or src, result)
+        return self
+
+    @staticmethod
+    def _stack_crops(data):
+        """ Make one array out of sequence of crops with the same shapes. """
+        if isinstance(data, np.ndarray) and data.dtype != object:
+            return data
+        return np.stack(data)
+
+
     def plot_components(self, *components, idx=0, mode='overlap', order_axes=None, **kwargs):
         """ Plot components of batch.
 
@@ -946,3 +1385,126 @@ class SeismicCropBatch(Batch):
         }
 
         plot_image(imgs, mode=mode, order_axes=order_axes, **kwargs)
+
+
+
+def _rotation_matrices(angles, scales, center):
+    """ Matrices of rotation and zoom around the `center`, the same as `cv2.getRotationMatrix2D`. """
+    radians = np.deg2rad(angles)
+    alpha, beta = scales * np.cos(radians), scales * np.sin(radians)
+    matrices = np.zeros((len(angles), 3, 3))
+    matrices[:, 0, 0], matrices[:, 0, 1] = alpha, beta
+    matrices[:, 1, 0], matrices[:, 1, 1] = -beta, alpha
+    matrices[:, 0, 2] = (1 - alpha) * center[0] - beta * center[1]
+    matrices[:, 1, 2] = beta * center[0] + (1 - alpha) * center[1]
+    matrices[:, 2, 2] = 1
+    return matrices
+
+def _random_point_matrices(alphas, shape, n_points, rng):
+    """ Affine (for three points) or perspective (for four points) transforms, that move points around
+    the center of crop by at most `alphas` along each axis. Same as `cv2.getAffineTransform` and
+    `cv2.getPerspectiveTransform`, but for multiple sets of points at once.
+    """
+    center = np.array([shape[1] // 2, shape[0] // 2])
+    size = min(shape) // 3
+    src = np.array([center + size, center - size,
+                    [center[0] + size, center[1] - size],
+                    [center[0] - size, center[1] + size]])[:n_points]
+    src = np.broadcast_to(src, (len(alphas), n_points, 2))
+    dst = src + rng.uniform(-1, 1, size=src.shape) * alphas.reshape(-1, 1, 1)
+
+    # Linear system for the coefficients of each matrix: two equations per point
+    x, y, u, v = src[..., 0], src[..., 1], dst[..., 0], dst[..., 1]
+    ones, zeros = np.ones_like(x), np.zeros_like(x)
+    if n_points == 3:
+        rows_u = [x, y, ones, zeros, zeros, zeros]
+        rows_v = [zeros, zeros, zeros, x, y, ones]
+    else:
+        rows_u = [x, y, ones, zeros, zeros, zeros, -u * x, -u * y]
+        rows_v = [zeros, zeros, zeros, x, y, ones, -v * x, -v * y]
+    system = np.concatenate([np.stack(rows_u, axis=-1), np.stack(rows_v, axis=-1)], axis=1)
+    coefficients = np.linalg.solve(system, np.concatenate([u, v], axis=1)[..., None])[..., 0]
+
+    matrices = np.zeros((len(alphas), 9))
+    matrices[:, :len(coefficients[0])] = coefficients
+    matrices[:, 8] = 1
+    if n_points == 3:
+        matrices[:, 6:8] = 0
+    return matrices.reshape(-1, 3, 3)
+
+@njit(parallel=True)
+def _warp_batch(array, matrices, fields, active, reflect, out):
+    """ Bilinear resampling of `(n, height, width, channels)` array: each point `(x, y)` of the item `k` is
+    taken from the point `matrices[k] @ (x + dx, y + dy, 1)` of the source, where `dx, dy` are
+    displacements from `fields[k]`, bilinearly upsampled to the crop shape the same way `cv2.resize` does.
+    """
+    n, height, width, channels = array.shape
+    field_height, field_width = fields.shape[2], fields.shape[3]
+    use_fields = field_height > 1 or field_width > 1
+
+    # Positions in the coarse displacement field are the same for all rows and columns
+    fy0, fy1, wy = _resize_positions(height, field_height)
+    fx0, fx1, wx = _resize_positions(width, field_width)
+
+    for idx in prange(n * height):
+        k, i = idx // height, idx % height
+        if not active[k]:
+            out[k, i] = array[k, i]
+            continue
+        matrix = matrices[k]
+        out[k, i] = 0
+
+        for j in range(width):
+            x, y = float(j), float(i)
+            if use_fields:
+                x += _bilinear(fields[k, 0], fy0[i], fy1[i], fx0[j], fx1[j], wy[i], wx[j])
+                y += _bilinear(fields[k, 1], fy0[i], fy1[i], fx0[j], fx1[j], wy[i], wx[j])
+
+            denominator = matrix[2, 0] * x + matrix[2, 1] * y + matrix[2, 2]
+            sx = (matrix[0, 0] * x + matrix[0, 1] * y + matrix[0, 2]) / denominator
+            sy = (matrix[1, 0] * x + matrix[1, 1] * y + matrix[1, 2]) / denominator
+            x0, y0 = int(np.floor(sx)), int(np.floor(sy))
+            weight_x, weight_y = sx - x0, sy - y0
+
+            for dy in range(2):
+                row = y0 + dy
+                if reflect:
+                    row = _reflect_101(row, height)
+                elif row < 0 or row >= height:
+                    continue
+                weight_row = weight_y if dy else 1 - weight_y
+
+                for dx in range(2):
+                    column = x0 + dx
+                    if reflect:
+                        column = _reflect_101(column, width)
+                    elif column < 0 or column >= width:
+                        continue
+                    weight = weight_row * (weight_x if dx else 1 - weight_x)
+
+                    for c in range(channels):
+                        out[k, i, j, c] += weight * array[k, row, column, c]
+
+@njit
+def _resize_positions(size, field_size):
+    """ Neighbouring points and weights of the second one to upsample `field_size` to `size`. """
+    ratio = field_size / size
+    positions = np.minimum(np.maximum((np.arange(size) + 0.5) * ratio - 0.5, 0.0), field_size - 1.0)
+    lower = positions.astype(np.int64)
+    upper = np.minimum(lower + 1, field_size - 1)
+    return lower, upper, positions - lower
+
+@njit
+def _bilinear(field, y0, y1, x0, x1, wy, wx):
+    """ Value of the 2D `field` between its four points. """
+    return ((1 - wy) * ((1 - wx) * field[y0, x0] + wx * field[y0, x1])
+            + wy * ((1 - wx) * field[y1, x0] + wx * field[y1, x1]))
+
+@njit
+def _reflect_101(idx, size):
+    """ Mirror index without repeating the border element, as `cv2.BORDER_REFLECT_101` does. """
+    if size == 1:
+        return 0
+    period = 2 * size - 2
+    idx = abs(idx) % period
+    return period - idx if idx >= size else idx
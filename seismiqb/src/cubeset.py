@@ -1,5 +1,6 @@
 """ Contains container for storing dataset of seismic crops. """
 #pylint: disable=too-many-lines
+import os
 from glob import glob
 
 import numpy as np
@@ -13,7 +14,7 @@ from .crop_batch import SeismicCropBatch
 from .horizon import Horizon, UnstructuredHorizon
 from .metrics import HorizonMetrics
 from .plotters import plot_image
-from .utils import IndexedDict, round_to_array, gen_crop_coordinates
+from .utils import IndexedDict, SlideCache, Accumulator3D, round_to_array, gen_crop_coordinates
 
 
 
@@ -121,6 +122,25 @@ class SeismicCubeset(Dataset):
             if logs:
                 self.geometries[ix].log()
 
+    def share_slide_cache(self, maxbytes=None):
+        """ Make all of the geometries use the same slide cache, so that memory budget is common for all cubes.
+
+        Parameters
+        ----------
+        maxbytes : int, optional
+            Memory budget of the shared cache. By default, sum of budgets of current caches.
+
+        Returns
+        -------
+        SlideCache
+            Shared cache instance. Its `info` method allows to get stats for each of the cubes.
+        """
+        maxbytes = maxbytes or sum(geometry.slide_cache.maxbytes for geometry in self.geometries.values())
+        slide_cache = SlideCache(maxbytes=maxbytes)
+        for geometry in self.geometries.values():
+            geometry.slide_cache = slide_cache
+        return slide_cache
+
     def convert_to_hdf5(self, postfix=''):
         """ Converts every cube in dataset from `.segy` to `.hdf5`. """
         for ix in self.indices:
@@ -133,7 +153,8 @@ class SeismicCubeset(Dataset):
         Parameters
         ----------
         paths : dict
-            Mapping from indices to txt paths with labels.
+            Mapping from indices to txt paths with labels. If horizon has a binary version next to the
+            text one (made by :meth:`~.Horizon.dump_binary` with the same path), it is loaded instead.
         dst : str
             Name of attribute to put labels in.
 
@@ -152,7 +173,13 @@ class SeismicCubeset(Dataset):
                 else:
                     labels_class = UnstructuredHorizon
 
-            label_list = [labels_class(path, self.geometries[ix], **kwargs) for path in paths[ix]]
+            label_paths = paths[ix]
+            if isinstance(labels_class, type) and issubclass(labels_class, Horizon):
+                label_paths = [labels_class.binary_path(path) if os.path.exists(labels_class.binary_path(path))
+                               else path for path in label_paths]
+                label_paths = list(dict.fromkeys(label_paths))
+
+            label_list = [labels_class(path, self.geometries[ix], **kwargs) for path in label_paths]
             label_list.sort(key=lambda label: label.h_mean)
             if filter_zeros:
                 _ = [getattr(item, 'filter')() for item in label_list]
@@ -339,10 +366,9 @@ class SeismicCubeset(Dataset):
                              adaptive_slices=adaptive_slices, grid_src=grid_src)
                  .next_batch(self.size))
 
-        unsalted = np.array([batch.unsalt(item) for item in batch.indices])
         background = np.zeros_like(self.geometries[idx].zero_traces)
 
-        for slice_ in np.array(batch.locations)[unsalted == self.indices[idx]]:
+        for slice_ in np.array(batch.locations)[batch.crop_names == self.indices[idx]]:
             idx_i, idx_x, _ = slice_
             background[idx_i, idx_x] += 1
 
@@ -386,7 +412,8 @@ class SeismicCubeset(Dataset):
 
 
     def make_grid(self, cube_name, crop_shape, ilines=None, xlines=None, heights=None,
-                  overlap=None, overlap_factor=None, batch_size=16, filtering_matrix=None, filter_threshold=0):
+                  overlap=None, overlap_factor=None, batch_size=16, filtering_matrix=None, filter_threshold=0,
+                  prefetch=0, order=(0, 1, 2)):
         """ Create regular grid of points in cube.
         This method is usually used with `assemble_predict` action of SeismicCropBatch.
 
@@ -422,6 +449,12 @@ class SeismicCubeset(Dataset):
             Exclusive lower bound for non-gap number of points (with 0's in the filtering_matrix)
             in a crop in the grid. Default value is 0.
             If float, proportion from the total number of traces in a crop will be computed.
+        prefetch : int
+            Number of batches to look ahead: slides for their crops are loaded into geometry cache
+            in background threads while the current batch is processed. If 0, then no prefetching is done.
+        order : sequence of three ints
+            Order of axes to walk the grid along: the first one changes the slowest.
+            For example, `(1, 0, 2)` yields points xline by xline.
         """
         geometry = self.geometries[cube_name]
         overlap = overlap or crop_shape
@@ -455,39 +488,41 @@ class SeismicCubeset(Dataset):
         # Make separate grids for every axis
         def _make_axis_grid(axis_range, stride, length, crop_shape):
             grid = np.arange(*axis_range, stride)
-            grid_ = [x for x in grid if x + crop_shape < length]
+            grid_ = grid[grid + crop_shape < length]
             if len(grid) != len(grid_):
-                grid_ += [axis_range[1] - crop_shape]
-            return sorted(grid_)
+                grid_ = np.append(grid_, axis_range[1] - crop_shape)
+            return np.sort(grid_)
 
         ilines_grid = _make_axis_grid(ilines, overlap[0], geometry.ilines_len, crop_shape[0])
         xlines_grid = _make_axis_grid(xlines, overlap[1], geometry.xlines_len, crop_shape[1])
         heights_grid = _make_axis_grid(heights, overlap[2], geometry.depth, crop_shape[2])
 
-        # Every point in grid contains reference to cube
-        # in order to be valid input for `crop` action of SeismicCropBatch
-        grid = []
-        for il in ilines_grid:
-            for xl in xlines_grid:
-                if np.prod(crop_shape[:2]) - np.sum(filtering_matrix[il: il + crop_shape[0],
-                                                                     xl: xl + crop_shape[1]]) > filter_threshold:
-                    for h in heights_grid:
-                        point = [cube_name, il, xl, h]
-                        grid.append(point)
+        # Number of gaps in each (iline, xline) window from the summed-area table of the filtering matrix:
+        # integer matrices are summed exactly, others in float64
+        is_integer = np.issubdtype(filtering_matrix.dtype, np.integer) or filtering_matrix.dtype == bool
+        dtype = np.int64 if is_integer else np.float64
+        table = np.zeros((filtering_matrix.shape[0] + 1, filtering_matrix.shape[1] + 1), dtype=dtype)
+        table[1:, 1:] = np.cumsum(np.cumsum(filtering_matrix, axis=0, dtype=dtype), axis=1)
+        il_starts = ilines_grid.clip(0, filtering_matrix.shape[0])
+        xl_starts = xlines_grid.clip(0, filtering_matrix.shape[1])
+        il_stops = (ilines_grid + crop_shape[0]).clip(0, filtering_matrix.shape[0])
+        xl_stops = (xlines_grid + crop_shape[1]).clip(0, filtering_matrix.shape[1])
+        gaps = (table[il_stops][:, xl_stops] - table[il_starts][:, xl_stops]
+                - table[il_stops][:, xl_starts] + table[il_starts][:, xl_starts])
+        il_idx, xl_idx = np.nonzero(np.prod(crop_shape[:2]) - gaps > filter_threshold)
+
+        # Every point in grid contains id of the cube in the dataset index and coordinates of the point
+        grid = np.empty((len(il_idx) * len(heights_grid), 4), dtype=np.int32)
+        grid[:, 0] = list(self.indices).index(cube_name)
+        grid[:, 1] = np.repeat(ilines_grid[il_idx], len(heights_grid))
+        grid[:, 2] = np.repeat(xlines_grid[xl_idx], len(heights_grid))
+        grid[:, 3] = np.tile(heights_grid, len(il_idx))
+        if tuple(order) != (0, 1, 2):
+            grid = grid[np.lexsort([grid[:, axis + 1] for axis in reversed(order)])]
 
         shifts = np.array([ilines[0], xlines[0], heights[0]])
-
-        grid = np.array(grid, dtype=object)
-
-        # Creating and storing all the necessary things
-        # Check if grid is not empty
-        if len(grid) > 0:
-            grid_gen = (grid[i:i+batch_size]
-                        for i in range(0, len(grid), batch_size))
-            grid_array = grid[:, 1:].astype(int) - shifts
-        else:
-            grid_gen = iter(())
-            grid_array = []
+        grid_array = grid[:, 1:] - shifts.astype(np.int32)
+        grid_gen = self._make_grid_gen(grid, geometry, crop_shape, batch_size, prefetch)
 
         predict_shape = (ilines[1] - ilines[0],
                          xlines[1] - xlines[0],
@@ -496,6 +531,7 @@ class SeismicCubeset(Dataset):
         self.grid_gen = lambda: next(grid_gen)
         self.grid_iters = - (-len(grid) // batch_size)
         self.grid_info = {
+            'grid': grid,
             'grid_array': grid_array,
             'predict_shape': predict_shape,
             'crop_shape': crop_shape,
@@ -506,6 +542,28 @@ class SeismicCubeset(Dataset):
         }
 
 
+    def _make_grid_gen(self, grid, geometry, crop_shape, batch_size, prefetch=0):
+        """ Yield batches of grid as points for `crop` action, warming up geometry cache for the ones
+        `prefetch` steps ahead. Points of a batch are made only when it is requested.
+        """
+        def locations(start):
+            return [[slice(point[i + 1], point[i + 1] + crop_shape[i]) for i in range(3)]
+                    for point in grid[start:start + batch_size]]
+
+        starts = range(0, len(grid), batch_size)
+        for start in starts[:prefetch]:
+            geometry.prefetch(locations(start))
+        for i, start in enumerate(starts):
+            if prefetch and i + prefetch < len(starts):
+                geometry.prefetch(locations(starts[i + prefetch]))
+
+            batch_grid = grid[start:start + batch_size]
+            points = np.empty(batch_grid.shape, dtype=object)
+            points[:, 0] = np.asarray(self.indices)[batch_grid[:, 0]]
+            points[:, 1:] = batch_grid[:, 1:]
+            yield points
+
+
     def mask_to_horizons(self, src, cube_name, threshold=0.5, averaging='mean', minsize=0,
                          dst='predicted_horizons', prefix='predict', src_grid_info='grid_info'):
         """ Convert mask to a list of horizons.
@@ -731,7 +789,8 @@ class SeismicCubeset(Dataset):
                           'geom': horizon.geometry}
 
 
-    def assemble_crops(self, crops, grid_info='grid_info', order=None, fill_value=0):
+    def assemble_crops(self, crops, grid_info='grid_info', order=None, fill_value=0, aggregation='max',
+                       window='gaussian', batch_size=16):
         """ Glue crops together in accordance to the grid.
 
         Note
@@ -741,7 +800,7 @@ class SeismicCubeset(Dataset):
         Parameters
         ----------
         crops : sequence
-            Sequence of crops.
+            Sequence of crops. To aggregate crops as soon as they are predicted, use :class:`.Accumulator3D`.
         grid_info : dict or str
             Dictionary with information about grid. Should be created by `make_grid` method.
         order : tuple of int
@@ -750,6 +809,12 @@ class SeismicCubeset(Dataset):
             applied to images-tensor.
         fill_value : float
             Fill_value for background array if `len(crops) == 0`.
+        aggregation : str
+            How to combine overlapping crops: `max`, `mean` or `weighted`. See :class:`.Accumulator3D` for details.
+        window : str or np.ndarray
+            Weights of points of a crop for `weighted` aggregation, for example, `gaussian` or `cosine`.
+        batch_size : int
+            Number of crops to transpose and add to the accumulator at once.
 
         Returns
         -------
@@ -765,23 +830,19 @@ class SeismicCubeset(Dataset):
         if len(crops) != len(grid_info['grid_array']):
             raise ValueError('Length of crops must be equal to number of crops in a grid')
         order = order or (2, 0, 1)
-        crops = np.array(crops)
+        dtype = np.float32
         if len(crops) != 0:
-            fill_value = np.min(crops)
+            fill_value = min(np.min(crop) for crop in crops)
+            dtype = np.asarray(crops[0]).dtype
 
         grid_array = grid_info['grid_array']
         crop_shape = grid_info['crop_shape']
-        background = np.full(grid_info['predict_shape'], fill_value)
-
-        for i in range(len(grid_array)):
-            il, xl, h = grid_array[i, :]
-            il_end = min(background.shape[0], il+crop_shape[0])
-            xl_end = min(background.shape[1], xl+crop_shape[1])
-            h_end = min(background.shape[2], h+crop_shape[2])
-
-            crop = np.transpose(crops[i], order)
-            crop = crop[:(il_end-il), :(xl_end-xl), :(h_end-h)]
-            previous = background[il:il_end, xl:xl_end, h:h_end]
-            background[il:il_end, xl:xl_end, h:h_end] = np.maximum(crop, previous)
-
-        return background
+        accumulator = Accumulator3D(grid_info['predict_shape'], aggregation=aggregation, window=window,
+                                    dtype=dtype if aggregation == 'max' else np.float32, fill_value=fill_value)
+
+        for start in range(0, len(crops), batch_size):
+            locations = [[slice(point[i], point[i] + crop_shape[i]) for i in range(3)]
+                         for point in grid_array[start:start + batch_size]]
+            accumulator.update_batch([np.transpose(crop, order) for crop in crops[start:start + batch_size]],
+                                     locations)
+        return accumulator.aggregate()
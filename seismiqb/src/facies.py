@@ -12,7 +12,7 @@ from skimage.measure import label
 from ..batchflow import HistoSampler
 
 from .plotters import plot_image
-from .utils import groupby_min, groupby_max
+from .utils import groupby_min, groupby_max, read_point_cloud
 
 
 
@@ -161,7 +161,6 @@ class GeoBody:
 
     def file_to_points(self, path):
         """ Get point cloud array from file values. """
-        #pylint: disable=anomalous-backslash-in-string
         with open(path) as file:
             line_len = len(file.readline().split(' '))
         if line_len == 4:
@@ -169,9 +168,8 @@ class GeoBody:
         else:
             raise ValueError('GeoBody labels must be in FACIES_SPEC format.')
 
-        df = pd.read_csv(path, sep='\s+', names=names, usecols=GeoBody.COLUMNS)
-        df.sort_values(GeoBody.COLUMNS, inplace=True)
-        return df.values
+        points = read_point_cloud(path, usecols=[names.index(column) for column in GeoBody.COLUMNS])
+        return points[np.lexsort(points.T[::-1])]
 
     @staticmethod
     def points_to_matrix(points, i_min, x_min, i_length, x_length):
@@ -4,8 +4,13 @@ import sys
 import shutil
 
 from textwrap import dedent
-from random import random
 from itertools import product
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from threading import Event, Lock
+from queue import Queue
+from time import perf_counter
+from multiprocessing import get_context
 from tqdm.auto import tqdm
 
 import numpy as np
@@ -13,8 +18,9 @@ import pandas as pd
 import h5py
 import segyio
 import cv2
+from numba import njit, prange
 
-from .utils import lru_cache, find_min_max, file_print, SafeIO
+from .utils import lru_cache, file_print, SafeIO, SlideCache
 from .plotters import plot_image
 
 
@@ -98,8 +104,8 @@ class SeismicGeometry:
           a proxy for amplitudes in each trace for evaluating aggregated statistics.
 
         - `load_slide` (2D entity) or `load_crop` (3D entity) methods to load data from the cube.
-          Load slides takes a number of slide and axis to cut along; makes use of `lru_cache` to work
-          faster for subsequent loads. Cache is bound for each instance.
+          Load slides takes a number of slide and axis to cut along; makes use of `slide_cache` to work
+          faster for subsequent loads. Cache is bounded by size in bytes and can be shared between instances.
           Load crops works off of complete location specification (3D slice).
 
         - `quality_map` attribute is a spatial matrix that estimates cube hardness;
@@ -108,6 +114,9 @@ class SeismicGeometry:
         - `show_slide` method allows to do exactly what the name says, and has the same API as `load_slide`.
           `repr` allows to get a quick summary of the cube statistics.
 
+        - Instances can be pickled, for example, to be sent to worker processes: file handlers are not serialized,
+          but reopened at the first access after unpickling. Contents of `slide_cache` are not sent either.
+
     Refer to the documentation of respective classes to learn more about their structure, attributes and methods.
     """
     #TODO: add separate class for cube-like labels
@@ -135,6 +144,19 @@ class SeismicGeometry:
     INDEX_POST = ['INLINE_3D', 'CROSSLINE_3D']
     INDEX_CDP = ['CDP_Y', 'CDP_X']
 
+    # Big-endian dtypes of SEG-Y sample formats: IBM floats are read as raw integers and converted afterwards
+    SEGY_SAMPLE_FORMATS = {1: '>u4', 2: '>i4', 3: '>i2', 5: '>f4', 8: 'i1'}
+
+    # HDF5 projections: dataset name and order of cube axes (ilines, xlines, depth) in it
+    PROJECTIONS = {0: ('cube', (0, 1, 2)), 1: ('cube_x', (1, 2, 0)), 2: ('cube_h', (2, 0, 1))}
+    PROJECTION_NAMES = {'i': 0, 'x': 1, 'h': 2}
+
+    # Default chunk shapes of HDF5 projections in cube orientation, tuned for 2D crops along each of the axes
+    DEFAULT_CHUNKS = {0: (1, 256, 256), 1: (256, 1, 256), 2: (256, 256, 1)}
+
+    # Attributes with file handlers: they are not pickled and are reopened at the first access after unpickling
+    HANDLERS = ()
+
     def __new__(cls, path, *args, **kwargs):
         """ Select the type of geometry based on file extension. """
         _ = args, kwargs
@@ -150,10 +172,16 @@ class SeismicGeometry:
         instance = super().__new__(new_cls)
         return instance
 
-    def __init__(self, path, *args, process=True, **kwargs):
+    def __init__(self, path, *args, process=True, slide_cache=None, **kwargs):
         _ = args
         self.path = path
 
+        # Either a separate cache with a given size in bytes, or the shared one
+        if not isinstance(slide_cache, SlideCache):
+            slide_cache = SlideCache(maxbytes=slide_cache or SlideCache.DEFAULT_SIZE)
+        self.slide_cache = slide_cache
+        self.prefetcher = None
+
         # Names of different lengths and format: helpful for outside usage
         self.name = os.path.basename(self.path)
         self.short_name = self.name.split('.')[0]
@@ -175,10 +203,40 @@ class SeismicGeometry:
             return np.prod(self.zero_matrix.shape) - self.zero_matrix.sum()
         return len(self.dataframe)
 
-
-    def store_meta(self):
-        """ Store collected stats on disk. """
-        path_meta = os.path.splitext(self.path)[0] + '.meta'
+    # Pickling: allows to send geometries to other processes
+    def __getnewargs__(self):
+        return (self.path,)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['prefetcher'] = None
+        state.pop('_reopen_lock', None)
+        state.pop('_read_lock', None)
+        for name in self.HANDLERS:
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reopen_lock = Lock() # pylint: disable=attribute-defined-outside-init
+        self._read_lock = Lock() # pylint: disable=attribute-defined-outside-init
+
+    def __getattr__(self, key):
+        # Called only for missing attributes: file handlers of unpickled instance are opened lazily
+        if key in type(self).HANDLERS and '_reopen_lock' in self.__dict__:
+            with self._reopen_lock:
+                if key not in self.__dict__:
+                    self.reopen()
+            return self.__dict__[key]
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{key}'")
+
+    def reopen(self):
+        """ Open file handlers of the cube. """
+        raise NotImplementedError
+
+    def store_meta(self, path=None):
+        """ Store collected stats on disk: right next to the cube at `path`, by default, the current one. """
+        path_meta = os.path.splitext(path or self.path)[0] + '.meta'
 
         # Remove file, if exists: h5py can't do that
         if os.path.exists(path_meta):
@@ -210,7 +268,7 @@ class SeismicGeometry:
                     pass
 
 
-    def scaler(self, array, mode='minmax'):
+    def scaler(self, array, mode='minmax', out=None):
         """ Normalize array of amplitudes cut from the cube.
 
         Parameters
@@ -223,14 +281,27 @@ class SeismicGeometry:
             0.01 and 0.99 quantiles.
             If `q_clip`, then data is clipped to 0.01 and 0.99 quantiles and then divided by the
             maximum of absolute values of the two.
+        out : ndarray, optional
+            Array to put the result into. Can be the same as `array` to scale it in place.
         """
+        if out is None:
+            if mode in ['q', 'normalize']:
+                return array / max(abs(self.q01), abs(self.q99))
+            if mode in ['q_clip']:
+                return np.clip(array, self.q01, self.q99) / max(abs(self.q01), abs(self.q99))
+            if mode == 'minmax':
+                scale = (self.value_max - self.value_min)
+                return (array - self.value_min) / scale
+            raise ValueError('Wrong mode', mode)
+
         if mode in ['q', 'normalize']:
-            return array / max(abs(self.q01), abs(self.q99))
+            return np.divide(array, max(abs(self.q01), abs(self.q99)), out=out)
         if mode in ['q_clip']:
-            return np.clip(array, self.q01, self.q99) / max(abs(self.q01), abs(self.q99))
+            np.clip(array, self.q01, self.q99, out=out)
+            return np.divide(out, max(abs(self.q01), abs(self.q99)), out=out)
         if mode == 'minmax':
-            scale = (self.value_max - self.value_min)
-            return (array - self.value_min) / scale
+            np.subtract(array, self.value_min, out=out)
+            return np.divide(out, self.value_max - self.value_min, out=out)
         raise ValueError('Wrong mode', mode)
 
 
@@ -255,6 +326,42 @@ class SeismicGeometry:
         locations[axis] = slice(loc, loc + 1)
         return locations
 
+    def prefetch(self, locations, max_workers=4, **kwargs):
+        """ Warm up `slide_cache` with slides, required to load crops at `locations`, in background threads.
+        Subsequent `load_crop` calls take slides from the cache or wait for the ones that are still being loaded,
+        so disk reads overlap with the rest of the computations.
+
+        Parameters
+        ----------
+        locations : sequence
+            Locations of crops: each is a sequence of slices along the first index, the second, and depth.
+        max_workers : int
+            Number of loading threads. Used only at the first call, when thread pool is created.
+        kwargs : dict
+            Other parameters of `load_crop`, that affect the choice of slides.
+
+        Returns
+        -------
+        list
+            Futures of submitted loads.
+        """
+        if self.prefetcher is None:
+            self.prefetcher = ThreadPoolExecutor(max_workers=max_workers,
+                                                 thread_name_prefix=f'prefetch_{self.short_name}')
+
+        futures, submitted = [], set()
+        for location in locations:
+            for key, loader in self._slide_loaders(location, **kwargs):
+                if key not in submitted and key not in self.slide_cache:
+                    submitted.add(key)
+                    futures.append(self.prefetcher.submit(loader))
+        return futures
+
+    def _slide_loaders(self, locations, **kwargs):
+        """ Keys and loaders of slides, used by `load_crop` at `locations`. """
+        _ = locations, kwargs
+        return []
+
 
     # Spatial matrices
     @lru_cache(100)
@@ -541,12 +648,19 @@ class SeismicGeometrySEGY(SeismicGeometry):
     One can add stats to the instance by calling `collect_stats` method, that makes a full pass through
     the cube in order to analyze distribution of amplitudes. It also collects a number of trace examples
     into `trace_container` attribute, that can be used for later evaluation of various statistics.
+
+    If the file consists of fixed-size traces, amplitudes are read through the structured `memmap` view of the
+    data section, so that crops and slides are gathered with one call instead of loading traces one by one.
     """
     #pylint: disable=attribute-defined-outside-init, too-many-instance-attributes
+    HANDLERS = ('segyfile', 'memmap')
+
     def __init__(self, path, headers=None, index_headers=None, **kwargs):
         self.structured = False
         self.dataframe = None
         self.segyfile = None
+        self.memmap = None
+        self._read_lock = Lock()
 
         self.headers = headers or self.HEADERS_POST
         self.index_headers = index_headers or self.INDEX_POST
@@ -554,12 +668,17 @@ class SeismicGeometrySEGY(SeismicGeometry):
         super().__init__(path, **kwargs)
 
 
-    # Methods of inferring dataframe and amplitude stats
-    def process(self, collect_stats=False, recollect=False, **kwargs):
-        """ Create dataframe based on `segy` file headers. """
+    def reopen(self):
+        """ Open the file with `segyio` and make the `memmap` view of it. """
         # Note that all the `segyio` structure inference is disabled
         self.segyfile = SafeIO(self.path, opener=segyio.open, mode='r', strict=False, ignore_geometry=True)
         self.segyfile.mmap()
+        self.memmap = self._make_memmap()
+
+    # Methods of inferring dataframe and amplitude stats
+    def process(self, collect_stats=False, recollect=False, **kwargs):
+        """ Create dataframe based on `segy` file headers. """
+        self.reopen()
 
         self.depth = len(self.segyfile.trace[0])
         self.delay = self.segyfile.header[0].get(segyio.TraceField.DelayRecordingTime)
@@ -614,17 +733,33 @@ class SeismicGeometrySEGY(SeismicGeometry):
 
         self.cube_shape = np.asarray([*self.lens, self.depth])
 
-    def collect_stats(self, spatial=True, bins=25, num_keep=5000, **kwargs):
+        # Dense mapping from cube coordinates to trace numbers with -1 at absent traces.
+        # Available only for 2D indices without duplicates, for example, post-stack cubes
+        self.trace_index_matrix = None
+        if self.index_len == 2 and self.dataframe.index.is_unique:
+            positions = [np.searchsorted(self.uniques[i], self.dataframe.index.get_level_values(i).values)
+                         for i in range(self.index_len)]
+            trace_index_matrix = np.full(self.lens, -1, dtype=np.int64)
+            trace_index_matrix[positions[0], positions[1]] = self.dataframe['trace_index'].values
+            self.trace_index_matrix = trace_index_matrix
+
+    def collect_stats(self, spatial=True, bins=25, num_keep=5000, chunk_size=4096, num_workers=1,
+                      sample_size=1000, **kwargs):
         """ Pass through file data to collect stats:
             - min/max values.
-            - q01/q99 quantiles of amplitudes in the cube.
+            - q001/q01/q99/q999 quantiles of amplitudes in the cube.
             - certain amount of traces are stored to `trace_container` attribute.
 
-        If `spatial` is True, makes an additional pass through the cube to obtain following:
+        If `spatial` is True, following stats are also stored:
             - min/max/mean/std for every trace - `min_matrix`, `max_matrix` and so on.
             - histogram of values for each trace: - `hist_matrix`.
             - bins for histogram creation: - `bins`.
 
+        All of the stats are computed in one pass through the data: traces are read in contiguous blocks of
+        `chunk_size` traces and processed by jit-compiled kernels. Bins for histograms are inferred from
+        `sample_size` randomly chosen traces; the outermost bins are then extended to the actual min/max values
+        of the cube, so no amplitude is left out. The range of traces can be split between multiple processes.
+
         Parameters
         ----------
         spatial : bool
@@ -633,67 +768,73 @@ class SeismicGeometrySEGY(SeismicGeometry):
             Number of bins or name of automatic algorithm of defining number of bins.
         num_keep : int
             Number of traces to store.
+        chunk_size : int
+            Number of traces to read and process at once.
+        num_workers : int
+            Number of processes to split the range of traces between.
+        sample_size : int
+            Number of traces to infer histogram bins from.
         """
-        #pylint: disable=not-an-iterable
         _ = kwargs
-
         num_traces = len(self.segyfile.header)
 
-        # Get min/max values, store some of the traces
-        trace_container = []
-        value_min, value_max = np.inf, -np.inf
-
-        for i in tqdm(range(num_traces), desc='Finding min/max', ncols=1000):
-            trace = self.segyfile.trace[i]
-
-            trace_min, trace_max = find_min_max(trace)
-            if trace_min < value_min:
-                value_min = trace_min
-            if trace_max > value_max:
-                value_max = trace_max
-
-            if random() < (num_keep / num_traces) and trace_min != trace_max:
-                trace_container.extend(trace.tolist())
-                #TODO: add dtype for storing
+        # Infer bins from a random subset of traces
+        sample_indices = np.sort(np.random.choice(num_traces, size=min(sample_size, num_traces), replace=False))
+        sample = np.stack([self.segyfile.trace.raw[int(idx)] for idx in sample_indices])
+        bins = np.histogram_bin_edges(sample, bins).astype(np.float32)
+
+        # Split traces between workers
+        num_workers = max(1, min(num_workers, num_traces // chunk_size + 1))
+        ranges = np.linspace(0, num_traces, num_workers + 1).astype(np.int64)
+        seeds = np.random.randint(0, 2**31, size=num_workers)
+        tasks = [(self.path, start, stop, bins, chunk_size, num_keep, seed)
+                 for start, stop, seed in zip(ranges[:-1], ranges[1:], seeds)]
+
+        if num_workers == 1:
+            results = [_collect_stats_chunked(*tasks[0], segyfile=self.segyfile,
+                                              pbar=f'Collecting stats for {self.name}')]
+        else:
+            # Jit-compiled parallel kernels are not fork-safe, so workers are spawned
+            with ProcessPoolExecutor(max_workers=num_workers, mp_context=get_context('spawn')) as executor:
+                futures = [executor.submit(_collect_stats_chunked, *task) for task in tasks]
+                results = [future.result() for future in tqdm(futures, desc=f'Collecting stats for {self.name}',
+                                                              ncols=1000)]
+
+        # Merge partial results: they are ordered by trace number
+        trace_min = np.concatenate([result['min'] for result in results])
+        trace_max = np.concatenate([result['max'] for result in results])
+        trace_sum = np.concatenate([result['sum'] for result in results])
+        trace_sumsq = np.concatenate([result['sumsq'] for result in results])
+        trace_container = _merge_reservoirs([result['container'] for result in results],
+                                            [result['seen'] for result in results], num_keep)
+
+        value_min, value_max = float(np.min(trace_min)), float(np.max(trace_max))
+        bins[0], bins[-1] = min(bins[0], value_min), max(bins[-1], value_max)
+        self.bins = bins.astype(np.float64)
 
-        # Collect more spatial stats: min, max, mean, std, histograms matrices
         if spatial:
-            # Make bins
-            bins = np.histogram_bin_edges(None, bins, range=(value_min, value_max)).astype(np.float)
-            self.bins = bins
+            # Positions of each trace in the spatial matrices: traces, absent from the index, are skipped
+            positions = self._make_trace_positions()
+            present = (positions >= 0).all(axis=1)
+            store_key = tuple(positions[present].T)
+            is_zero = trace_min == trace_max
 
             # Create containers
             min_matrix, max_matrix = np.full(self.lens, np.nan), np.full(self.lens, np.nan)
+            mean_matrix, std_matrix = np.full(self.lens, np.nan), np.full(self.lens, np.nan)
             hist_matrix = np.full((*self.lens, len(bins)-1), np.nan)
 
-            # Iterate over traces
-            description = f'Collecting stats for {self.name}'
-            for i in tqdm(range(num_traces), desc=description, ncols=1000):
-                trace = self.segyfile.trace[i]
-                header = self.segyfile.header[i]
-
-                # i -> id in a dataframe
-                keys = [header.get(field) for field in self.byte_no]
-                store_key = [self.uniques_inversed[j][item] for j, item in enumerate(keys)]
-                store_key = tuple(store_key)
+            # Mean and std are restored exactly from sums of values and their squares
+            mean = trace_sum / self.depth
+            std = np.sqrt(np.clip(trace_sumsq / self.depth - mean ** 2, 0, None))
+            mean[is_zero], std[is_zero] = np.nan, np.nan
 
-                # For each trace, we store an entire histogram of amplitudes
-                val_min, val_max = find_min_max(trace)
-                min_matrix[store_key] = val_min
-                max_matrix[store_key] = val_max
+            min_matrix[store_key], max_matrix[store_key] = trace_min[present], trace_max[present]
+            mean_matrix[store_key], std_matrix[store_key] = mean[present], std[present]
 
-                if val_min != val_max:
-                    histogram = np.histogram(trace, bins=bins)[0]
-                    hist_matrix[store_key] = histogram
-
-            # Restore stats from histogram
-            midpoints = (bins[1:] + bins[:-1]) / 2
-            probs = hist_matrix / np.sum(hist_matrix, axis=-1, keepdims=True)
-
-            mean_matrix = np.sum(probs * midpoints, axis=-1)
-            std_matrix = np.sqrt(np.sum((np.broadcast_to(midpoints, (*mean_matrix.shape, len(midpoints))) - \
-                                            mean_matrix.reshape(*mean_matrix.shape, 1))**2 * probs,
-                                        axis=-1))
+            hist = np.concatenate([result['hist'] for result in results]).astype(np.float64)
+            hist[is_zero] = np.nan
+            hist_matrix[store_key] = hist[present]
 
             # Store everything into instance
             self.min_matrix, self.max_matrix = min_matrix, max_matrix
@@ -703,11 +844,29 @@ class SeismicGeometrySEGY(SeismicGeometry):
             self.zero_traces[np.isnan(min_matrix)] = 1
 
         self.value_min, self.value_max = value_min, value_max
-        self.trace_container = np.array(trace_container)
-        self.q001, self.q01, self.q99, self.q999 = np.quantile(trace_container, [0.001, 0.01, 0.99, 0.999])
+        self.trace_container = trace_container.ravel()
+        self.q001, self.q01, self.q99, self.q999 = np.quantile(self.trace_container, [0.001, 0.01, 0.99, 0.999])
         self.has_stats = True
         self.store_meta()
 
+    def _make_trace_positions(self):
+        """ Positions of every trace of the file in the spatial matrices of the current index.
+
+        Returns
+        -------
+        ndarray
+            Array of (num_traces, index_len) shape with each row being position of the trace along each index header.
+            Traces that are absent from the `dataframe` have -1 at each position.
+        """
+        num_traces = len(self.segyfile.header)
+        positions = np.full((num_traces, self.index_len), -1, dtype=np.int64)
+        trace_indices = self.dataframe['trace_index'].values
+
+        for i in range(self.index_len):
+            values = self.dataframe.index.get_level_values(i).values
+            positions[trace_indices, i] = np.searchsorted(self.uniques[i], values)
+        return positions
+
     def add_rotation_matrix(self):
         """ Add transform from INLINE/CROSSLINE corrdinates to CDP system. """
         ix_points = []
@@ -727,6 +886,38 @@ class SeismicGeometrySEGY(SeismicGeometry):
         self.rotation_matrix = cv2.getAffineTransform(np.float32(ix_points), np.float32(cdp_points))
 
 
+    def _make_memmap(self):
+        """ Create structured `np.memmap` view of the data section of the SEG-Y file.
+        Each element of the view is a trace with `header` and `data` fields.
+        Position of the data section and size of each trace are computed from the binary header.
+
+        Returns
+        -------
+        np.memmap or None
+            None, if the layout of the file can't be described by fixed-size traces with supported sample format.
+        """
+        sample_format = int(self.segyfile.format)
+        if sample_format not in self.SEGY_SAMPLE_FORMATS:
+            return None
+
+        num_traces = len(self.segyfile.header)
+        num_samples = len(self.segyfile.samples)
+        offset = 3600 + 3200 * self.segyfile.ext_headers
+        dtype = np.dtype([('header', 'V240'),
+                          ('data', self.SEGY_SAMPLE_FORMATS[sample_format], (num_samples,))])
+
+        # Traces of varying length or trailing data: fall back to the per-trace reading
+        if os.path.getsize(self.path) != offset + num_traces * dtype.itemsize:
+            return None
+        return np.memmap(self.path, dtype=dtype, mode='r', offset=offset, shape=(num_traces,))
+
+    def _convert_samples(self, array):
+        """ Convert array of samples, read from `memmap`, to native float32. """
+        if int(self.segyfile.format) == 1:
+            return _ibm_to_ieee(array.astype(np.uint32))
+        return array.astype(np.float32)
+
+
     def set_index(self, index_headers, sortby=None):
         """ Change current index to a subset of loaded headers. """
         self.dataframe.reset_index(inplace=True)
@@ -745,14 +936,38 @@ class SeismicGeometrySEGY(SeismicGeometry):
             return self.segyfile.trace.raw[int(index)]
         return self._zero_trace
 
-    def load_traces(self, trace_indices):
-        """ Stack multiple traces together. """
-        return np.stack([self.load_trace(idx) for idx in trace_indices])
+    def load_traces(self, trace_indices, heights=None):
+        """ Stack multiple traces together.
+        If `memmap` is available, traces are gathered from it in one call; otherwise, loaded one by one.
+        `np.nan` indices correspond to traces of zeros.
+
+        Parameters
+        ----------
+        trace_indices : sequence
+            Indices of traces to load.
+        heights : slice, optional
+            Range of depths to keep.
+        """
+        heights = heights or slice(None)
+        if self.memmap is None:
+            return np.stack([self.load_trace(idx) for idx in trace_indices])[..., heights]
+
+        trace_indices = np.asarray(trace_indices, dtype=np.float64)
+        present = ~np.isnan(trace_indices)
+        data = self.memmap['data']
+
+        if present.all():
+            return self._convert_samples(data[trace_indices.astype(np.int64), heights])
+
+        depth = len(range(*heights.indices(self.depth)))
+        traces = np.zeros((len(trace_indices), depth), dtype=np.float32)
+        traces[present] = self._convert_samples(data[trace_indices[present].astype(np.int64), heights])
+        return traces
 
 
-    @lru_cache(128, attributes='index_headers')
     def load_slide(self, loc=None, axis=0, start=None, end=None, step=1, stable=True):
         """ Create indices and load actual traces for one slide.
+        Loaded slides are stored in `slide_cache`.
 
         If the current index is 1D, then slide is defined by `start`, `end`, `step`.
         If the current index is 2D, then slide is defined by `loc` and `axis`.
@@ -768,11 +983,21 @@ class SeismicGeometrySEGY(SeismicGeometry):
         stable : bool
             Whether or not to use the same sorting order as in the segyfile.
         """
+        projection = (axis, start, end, step, stable, tuple(self.index_headers))
+        return self.slide_cache.get(self.path, projection, loc,
+                                    lambda: self._load_slide(loc=loc, axis=axis, start=start, end=end,
+                                                             step=step, stable=stable))
+
+    def _load_slide(self, loc=None, axis=0, start=None, end=None, step=1, stable=True):
         if axis in [0, 1]:
             indices = self.make_slide_indices(loc=loc, start=start, end=end, step=step, axis=axis, stable=stable)
             slide = self.load_traces(indices)
         elif axis == 2:
-            slide = self.segyfile.depth_slice[loc].reshape(self.lens)
+            if self.memmap is not None and self.trace_index_matrix is not None:
+                values = self._convert_samples(self.memmap['data'][:, loc])
+                slide = np.where(self.trace_index_matrix >= 0, values[self.trace_index_matrix], 0)
+            else:
+                slide = self.segyfile.depth_slice[loc].reshape(self.lens)
         return slide
 
     def make_slide_indices(self, loc=None, axis=0, start=None, end=None, step=1, stable=True, return_iterator=False):
@@ -821,6 +1046,10 @@ class SeismicGeometrySEGY(SeismicGeometry):
 
     def make_slide_indices_2d(self, loc, axis=0, stable=True, return_iterator=False):
         """ 2D version of index creation. """
+        if self.trace_index_matrix is not None:
+            return self._make_slide_indices_dense(loc=loc, axis=axis, stable=stable,
+                                                  return_iterator=return_iterator)
+
         other_axis = 1 - axis
         location = self.uniques[axis][loc]
 
@@ -841,6 +1070,28 @@ class SeismicGeometrySEGY(SeismicGeometry):
             return indices, iterator
         return indices
 
+    def _make_slide_indices_dense(self, loc, axis=0, stable=True, return_iterator=False):
+        """ 2D version of index creation, that uses `trace_index_matrix` instead of `dataframe` lookups. """
+        other_axis = 1 - axis
+        line = self.trace_index_matrix[loc, :] if axis == 0 else self.trace_index_matrix[:, loc]
+
+        if stable:
+            # Keep only present traces in the order of the segyfile
+            others = np.nonzero(line >= 0)[0]
+            others = others[np.argsort(line[others], kind='stable')]
+            indices = line[others].astype(np.float64)
+        else:
+            others = np.arange(len(line))
+            indices = np.where(line >= 0, line, np.nan)
+
+        if return_iterator:
+            location = self.uniques[axis][loc]
+            others = self.uniques[other_axis][others]
+            iterator = list(zip([location] * len(others), others) if axis == 0
+                            else zip(others, [location] * len(others)))
+            return indices, iterator
+        return indices
+
 
     def _load_crop(self, locations):
         """ Load 3D crop from the cube.
@@ -858,19 +1109,24 @@ class SeismicGeometrySEGY(SeismicGeometry):
         """
         shape = np.array([(slc.stop - slc.start) for slc in locations])
         indices = self.make_crop_indices(locations)
-        crop = self.load_traces(indices)[..., locations[-1]].reshape(shape)
+        crop = self.load_traces(indices, heights=locations[-1]).reshape(shape)
         return crop
 
     def make_crop_indices(self, locations):
         """ Create indices for 3D crop loading. """
+        if self.trace_index_matrix is not None:
+            indices = self.trace_index_matrix[locations[0], locations[1]].ravel()
+            return np.where(indices >= 0, indices, np.nan)
+
         iterator = list(product(*[[self.uniques[idx][i] for i in range(locations[idx].start, locations[idx].stop)]
                                   for idx in range(2)]))
         indices = self.dataframe['trace_index'].reindex(iterator, fill_value=np.nan).values
         _, unique_ind = np.unique(indices, return_index=True)
         return indices[np.sort(unique_ind, kind='stable')]
 
-    def load_crop(self, locations, threshold=15, mode='adaptive', **kwargs):
+    def load_crop(self, locations, threshold=15, mode='adaptive', out=None, **kwargs):
         """ Smart choice between using :meth:`._load_crop` and stacking multiple slides created by :meth:`.load_slide`.
+        Reads of files without `memmap` go through `segyio`, which is not thread-safe, so they are serialized.
 
         Parameters
         ----------
@@ -879,8 +1135,36 @@ class SeismicGeometrySEGY(SeismicGeometry):
             If `slide` or `crop`, then uses that function to load data.
         threshold : int
             Upper bound for amount of slides to load. Used only in `adaptive` mode.
+        out : ndarray, optional
+            Array of the crop shape to put loaded data into.
         """
         _ = kwargs
+        if self.memmap is None:
+            with self._read_lock:
+                return self._load_crop_any(locations, threshold=threshold, mode=mode, out=out)
+        return self._load_crop_any(locations, threshold=threshold, mode=mode, out=out)
+
+    def _load_crop_any(self, locations, threshold=15, mode='adaptive', out=None):
+        """ Load crop either from traces or from slides. """
+        mode, axis = self._choose_crop_mode(locations, threshold=threshold, mode=mode)
+
+        if mode == 'slide':
+            slc = locations[axis]
+            if axis in [0, 1]:
+                return np.stack([self.load_slide(loc, axis=axis, stable=False)[locations[1 - axis], locations[-1]]
+                                 for loc in range(slc.start, slc.stop)], axis=axis, out=out)
+            if axis == 2:
+                return np.stack([self.load_slide(loc, axis=axis)[locations[0], locations[1]]
+                                 for loc in range(slc.start, slc.stop)], axis=-1, out=out)
+
+        crop = self._load_crop(locations)
+        if out is not None:
+            out[...] = crop
+            return out
+        return crop
+
+    def _choose_crop_mode(self, locations, threshold=15, mode='adaptive'):
+        """ Decide whether to load crop from slides or directly from traces, and along which axis. """
         shape = np.array([(slc.stop - slc.start) for slc in locations])
         axis = np.argmin(shape)
         if mode == 'adaptive':
@@ -889,16 +1173,20 @@ class SeismicGeometrySEGY(SeismicGeometry):
             else:
                 flag = np.prod(shape[:2]) / np.prod(self.cube_shape[:2])
                 mode = 'slide' if flag > 0.1 else 'crop'
+        return mode, axis
 
-        if mode == 'slide':
-            slc = locations[axis]
-            if axis in [0, 1]:
-                return np.stack([self.load_slide(loc, axis=axis)[..., locations[-1]]
-                                 for loc in range(slc.start, slc.stop)], axis=axis)
-            if axis == 2:
-                return np.stack([self.load_slide(loc, axis=axis)[locations[0], locations[1]]
-                                 for loc in range(slc.start, slc.stop)], axis=-1)
-        return self._load_crop(locations)
+    def _slide_loaders(self, locations, threshold=15, mode='adaptive'):
+        """ Keys and loaders of slides, used by `load_crop` at `locations`.
+        Traces are read from multiple threads only through `memmap`, so without it nothing is prefetched.
+        """
+        mode, axis = self._choose_crop_mode(locations, threshold=threshold, mode=mode)
+        if mode != 'slide' or self.memmap is None:
+            return []
+
+        stable = axis == 2
+        projection = (axis, None, None, 1, stable, tuple(self.index_headers))
+        return [((self.path, projection, loc), partial(self.load_slide, loc, axis=axis, stable=stable))
+                for loc in range(locations[axis].start, locations[axis].stop)]
 
 
     def __getitem__(self, key):
@@ -925,8 +1213,13 @@ class SeismicGeometrySEGY(SeismicGeometry):
         return crop
 
     # Convert SEG-Y to HDF5
-    def make_hdf5(self, path_hdf5=None, postfix=''):
+    def make_hdf5(self, path_hdf5=None, postfix='', projections='ixh', chunks=None,
+                  compression=None, compression_opts=None, shuffle=False, scaleoffset=None,
+                  quantize=None, block_size=None, prefetch=2, memory_limit=2*1024**3):
         """ Converts `.segy` cube to `.hdf5` format.
+        Cube is read once, in blocks of consecutive ilines: each of the projections is made from the same block.
+        Blocks, that do not fit into `memory_limit`, are made of only a part of xlines.
+        Reading the next block overlaps with writing of the current one, as they are done in separate threads.
 
         Parameters
         ----------
@@ -934,12 +1227,54 @@ class SeismicGeometrySEGY(SeismicGeometry):
             Path to store converted cube. By default, new cube is stored right next to original.
         postfix : str
             Postfix to add to the name of resulting cube.
+        projections : str or sequence
+            Projections to write: any combination of `i` (ilines, xlines, depth), `x` (xlines, depth, ilines)
+            and `h` (depth, ilines, xlines). Crops are loaded from the cheapest of the available ones.
+        chunks : None, bool or dict
+            Chunk shapes of projections, given in cube orientation (ilines, xlines, depth).
+            If None or False, datasets are stored contiguously, unless compression is required.
+            If True, `DEFAULT_CHUNKS` are used. If dict, maps projection (`i`, `x`, `h` or axis number)
+            to its chunk shape; projections not in the dict use defaults.
+        compression : None, str or dict
+            Lossless filter to apply to chunks: `lzf`, `gzip` or any other filter available in `h5py`.
+            Filters from third-party plugins can be passed as dicts, for example, `hdf5plugin.Blosc()`.
+        compression_opts : None or int
+            Options of compression filter, for example, level of `gzip` compression.
+        shuffle : bool
+            Whether to apply byte shuffle filter before compression. Usually improves compression of floats.
+        scaleoffset : None or int
+            If int, then lossy scale-offset filter is used: amplitudes are stored with that many decimal digits.
+        quantize : None, str or dtype
+            If `int8` or `int16`, then amplitudes are linearly mapped from [q001, q999] range onto the range
+            of integer type, clipped and stored as integers. Scale and offset of the mapping are saved into
+            the `info` group of the file, and `SeismicGeometryHDF5` dequantizes loaded data on the fly.
+        block_size : None or int
+            Number of ilines to read at once. Rounded up to a multiple of chunk sizes along ilines, so that
+            each write covers whole chunks. If None, then the largest of the chunk sizes along ilines is used,
+            and 32 ilines for contiguous datasets.
+        prefetch : int
+            Maximum number of blocks, read ahead of the writer.
+        memory_limit : int
+            Approximate number of bytes for blocks in memory: about `prefetch + 3` of them are kept at once,
+            including the one being read and the one being written with its transposed copy.
+            If a block of whole xlines does not fit, then it is reduced to fewer ilines, and then split along
+            xlines; both are still multiples of chunk sizes, unless a single chunk-aligned block is larger.
         """
         if self.index_headers != self.INDEX_POST:
             # Currently supports only INLINE/CROSSLINE cubes
             raise TypeError(f'Current index must be {self.INDEX_POST}')
 
         path_hdf5 = path_hdf5 or (os.path.splitext(self.path)[0] + postfix + '.hdf5')
+        projections = [self.PROJECTION_NAMES.get(item, item) for item in projections]
+
+        # Quantization relies on amplitude quantiles, so stats are collected beforehand
+        if not self.has_stats:
+            self.collect_stats()
+        dtype = np.dtype(quantize or np.float32)
+        quantization = self.make_quantization(dtype) if quantize else None
+        dataset_kwargs = self.make_dataset_kwargs(chunks=chunks, compression=compression,
+                                                  compression_opts=compression_opts,
+                                                  shuffle=shuffle, scaleoffset=scaleoffset)
 
         # Remove file, if exists: h5py can't do that
         if os.path.exists(path_hdf5):
@@ -947,32 +1282,131 @@ class SeismicGeometrySEGY(SeismicGeometry):
 
         # Create file and datasets inside
         with h5py.File(path_hdf5, "a") as file_hdf5:
-            cube_hdf5 = file_hdf5.create_dataset('cube', self.cube_shape)
-            cube_hdf5_x = file_hdf5.create_dataset('cube_x', self.cube_shape[[1, 2, 0]])
-            cube_hdf5_h = file_hdf5.create_dataset('cube_h', self.cube_shape[[2, 0, 1]])
-
-            # Default projection (ilines, xlines, depth) and depth-projection (depth, ilines, xlines)
-            pbar = tqdm(total=self.ilines_len + self.xlines_len, ncols=1000)
-
-            pbar.set_description(f'Converting {self.long_name}; ilines projection')
-            for i in range(self.ilines_len):
-                slide = self.load_slide(i, stable=False)
-                cube_hdf5[i, :, :] = slide.reshape(1, self.xlines_len, self.depth)
-                cube_hdf5_h[:, i, :] = slide.T
-                pbar.update()
-
-            # xline-oriented projection: (xlines, depth, ilines)
-            pbar.set_description(f'Converting {self.long_name} to hdf5; xlines projection')
-            for x in range(self.xlines_len):
-                slide = self.load_slide(x, axis=1, stable=False).T
-                cube_hdf5_x[x, :, :,] = slide
-                pbar.update()
-            pbar.close()
-
-        if not self.has_stats:
-            self.collect_stats()
+            datasets = {}
+            for axis in projections:
+                name, order = self.PROJECTIONS[axis]
+                kwargs = dict(dataset_kwargs)
+                kwargs['chunks'] = self.make_chunks(chunks, axis) if kwargs['chunks'] else None
+                datasets[axis] = file_hdf5.create_dataset(name, self.cube_shape[list(order)],
+                                                          dtype=dtype, **kwargs)
+                datasets[axis].attrs['order'] = order
+            file_hdf5.attrs['projections'] = ''.join('ixh'[axis] for axis in sorted(projections))
+
+            if quantization is not None:
+                file_hdf5['/info/quantization_scale'], file_hdf5['/info/quantization_offset'] = quantization
+
+            # Make blocks aligned to chunks along ilines and xlines
+            i_steps, x_steps = [[dataset.chunks[self.PROJECTIONS[axis][1].index(i)] if dataset.chunks else 1
+                                 for axis, dataset in datasets.items()] for i in [0, 1]]
+            i_step, x_step = np.lcm.reduce(i_steps), np.lcm.reduce(x_steps)
+            block_size = block_size or (max(i_steps) if max(i_steps) > 1 else 32)
+            block_size = -(-block_size // i_step) * i_step
+
+            # Blocks are read as `float32`
+            block_memory = memory_limit // (prefetch + 3)
+            n_ilines = block_memory // (self.xlines_len * self.depth * 4)
+            block_size = min(block_size, max(n_ilines // i_step, 1) * i_step, self.ilines_len)
+            n_xlines = block_memory // (block_size * self.depth * 4)
+            block_xlines = min(max(n_xlines // x_step, 1) * x_step, self.xlines_len)
+
+            self._convert_blocks(datasets, block_shape=(block_size, block_xlines), prefetch=prefetch,
+                                 quantization=quantization)
         self.store_meta()
 
+        # Meta is looked up by the name of the cube, so the converted one must have its own
+        if os.path.splitext(path_hdf5)[0] != os.path.splitext(self.path)[0]:
+            self.store_meta(path=path_hdf5)
+
+    def make_quantization(self, dtype):
+        """ Scale and offset to map [q001, q999] range of amplitudes onto the range of integer `dtype`.
+        Offset is a multiple of scale, so that zero amplitudes are represented exactly.
+        """
+        limit = np.iinfo(dtype).max
+        scale = np.float32(max(self.q999 - self.q001, np.finfo(np.float32).eps) / (2 * limit))
+        offset = np.float32(np.round((self.q999 + self.q001) / (2 * scale))) * scale
+        return scale, offset
+
+    @staticmethod
+    def quantize(array, dtype, quantization):
+        """ Convert amplitudes to integer `dtype` with given scale and offset. """
+        scale, offset = quantization
+        limit = np.iinfo(dtype).max
+        array = np.round((array - offset) / scale)
+        return np.clip(array, -limit, limit, out=array).astype(dtype)
+
+    def _convert_blocks(self, datasets, block_shape, prefetch, quantization=None):
+        """ Read blocks of `block_shape` traces in one thread and write them into each of `datasets` in the other. """
+        dtype = next(iter(datasets.values())).dtype
+        queue, stop = Queue(maxsize=prefetch), Event()
+        start_time = perf_counter()
+
+        def reader():
+            try:
+                for i_start, x_start in product(range(0, self.ilines_len, block_shape[0]),
+                                                range(0, self.xlines_len, block_shape[1])):
+                    if stop.is_set():
+                        break
+                    locations = [slice(i_start, min(i_start + block_shape[0], self.ilines_len)),
+                                 slice(x_start, min(x_start + block_shape[1], self.xlines_len)),
+                                 slice(0, self.depth)]
+                    block = self.load_crop(locations, mode='crop')
+                    if quantization is not None:
+                        block = self.quantize(block, dtype, quantization)
+                    queue.put((locations, block))
+            finally:
+                queue.put(None)
+
+        def writer():
+            try:
+                for locations, block in iter(queue.get, None):
+                    for axis, dataset in datasets.items():
+                        order = self.PROJECTIONS[axis][1]
+                        dataset[tuple(locations[i] for i in order)] = block.transpose(order)
+
+                    pbar.update(block.shape[0] * block.shape[1])
+                    written = pbar.n * block[0, 0].nbytes * len(datasets) / (1024 ** 2)
+                    pbar.set_postfix_str(f'{written / (perf_counter() - start_time):.1f} MB/s')
+            except BaseException:
+                stop.set()
+                for _ in iter(queue.get, None):
+                    pass
+                raise
+
+        with tqdm(total=self.ilines_len * self.xlines_len, ncols=1000,
+                  desc=f'Converting {self.long_name} to hdf5') as pbar:
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                futures = [executor.submit(reader), executor.submit(writer)]
+                for future in futures:
+                    future.result()
+
+    @staticmethod
+    def make_dataset_kwargs(chunks=None, compression=None, compression_opts=None, shuffle=False, scaleoffset=None):
+        """ Storage-related keyword arguments for `h5py.File.create_dataset`.
+        Filters can be applied only to chunked datasets, so chunking is turned on whenever any of them is used.
+        """
+        kwargs = {}
+        if isinstance(compression, dict):
+            kwargs.update(compression)
+        elif compression is not None:
+            kwargs.update(compression=compression, compression_opts=compression_opts)
+        if shuffle:
+            kwargs['shuffle'] = True
+        if scaleoffset is not None:
+            kwargs['scaleoffset'] = scaleoffset
+
+        kwargs['chunks'] = bool(chunks) or bool(kwargs)
+        return kwargs
+
+    def make_chunks(self, chunks, axis):
+        """ Chunk shape of a projection along `axis`, in the order of the projection axes. """
+        chunks = chunks if isinstance(chunks, dict) else {}
+        chunks = {self.PROJECTION_NAMES.get(key, key): value for key, value in chunks.items()}
+        chunk_shape = np.array(chunks.get(axis, self.DEFAULT_CHUNKS[axis]))
+        chunk_shape = np.clip(chunk_shape, 1, self.cube_shape)
+
+        order = self.PROJECTIONS[axis][1]
+        return tuple(int(item) for item in chunk_shape[list(order)])
+
 
     # Convenient alias
     convert_to_hdf5 = make_hdf5
@@ -985,8 +1419,15 @@ class SeismicGeometryHDF5(SeismicGeometry):
 
     All the attributes are loaded directly from HDF5 file itself, so most of the attributes from SEG-Y file
     are preserved, with the exception of `dataframe` and `uniques`.
+
+    If the cube is stored quantized to integers, then `load_crop`, `load_slide` and `__getitem__` convert amplitudes
+    back to floats; pass `dequantize=False` to get raw integers and use :meth:`.dequantize` later.
     """
     #pylint: disable=attribute-defined-outside-init
+    # Estimated cost of one non-contiguous read in bytes: roughly, the size of HDF5 sieve buffer
+    READ_OVERHEAD = 64 * 1024
+    HANDLERS = ('file_hdf5',)
+
     def __init__(self, path, **kwargs):
         self.structured = True
         self.file_hdf5 = None
@@ -998,9 +1439,13 @@ class SeismicGeometryHDF5(SeismicGeometry):
         No passing through data whatsoever.
         """
         _ = kwargs
-        self.file_hdf5 = h5py.File(self.path, mode='r')
+        self.reopen()
         self.add_attributes()
 
+    def reopen(self):
+        """ Open the file with `h5py`. """
+        self.file_hdf5 = h5py.File(self.path, mode='r')
+
     def add_attributes(self):
         """ Store values from `hdf5` file to attributes. """
         self.index_headers = self.INDEX_POST
@@ -1008,11 +1453,115 @@ class SeismicGeometryHDF5(SeismicGeometry):
         self.cube_shape = np.asarray([self.ilines_len, self.xlines_len, self.depth]) # BC
         self.has_stats = True
 
+        # Layout of projections: older files may lack `projections` attribute, so datasets are checked directly
+        self.projections = [axis for axis, (name, _) in self.PROJECTIONS.items() if name in self.file_hdf5]
+        self.chunks = {axis: self.file_hdf5[self.PROJECTIONS[axis][0]].chunks for axis in self.projections}
+
+        # Quantization parameters are stored in the cube itself, as they depend on the conversion
+        if '/info/quantization_scale' in self.file_hdf5:
+            self.quantized = True
+            self.quantization_scale = self.file_hdf5['/info/quantization_scale'][()]
+            self.quantization_offset = self.file_hdf5['/info/quantization_offset'][()]
+        else:
+            self.quantized = False
+            self.quantization_scale, self.quantization_offset = None, None
+
+    def dequantize(self, array, out=None):
+        """ Convert raw integers, loaded from the quantized cube, to amplitudes. No-op for non-quantized cubes.
+        If `out` is provided, result is put into it; `out` can be the same array as the input one.
+        """
+        if not self.quantized:
+            return array
+        if out is None:
+            return array.astype(np.float32) * self.quantization_scale + self.quantization_offset
+
+        np.multiply(array, self.quantization_scale, out=out)
+        out += self.quantization_offset
+        return out
+
+    def projection_cost(self, locations, axis, mode='slide'):
+        """ Estimate amount of bytes to read from disk in order to load crop from projection along `axis`.
+
+        In `slide` mode crop is assembled from whole slides of a projection, so each of the slides, that are not
+        in `slide_cache` yet, requires to read either the entire row of contiguous data or all of the chunks,
+        intersecting the slide. In `crop` mode only the crop itself is read: all of the chunks, intersecting it,
+        or, for contiguous data, every contiguous run of the crop with an overhead of `READ_OVERHEAD` bytes.
+
+        Parameters
+        ----------
+        locations : sequence of slices
+            Location to load: slices along the first index, the second, and depth.
+        axis : int
+            Axis of the projection.
+        mode : str
+            Either `slide` or `crop`.
+        """
+        name, order = self.PROJECTIONS[axis]
+        dataset = self.file_hdf5[name]
+        dataset_shape = np.array(dataset.shape)
+        starts = np.array([locations[i].start for i in order])
+        stops = np.minimum([locations[i].stop for i in order], dataset_shape)
+        chunks = None if self.chunks[axis] is None else np.array(self.chunks[axis])
+
+        if mode == 'slide':
+            uncached = [loc for loc in range(starts[0], stops[0])
+                        if (self.path, dataset.name, loc) not in self.slide_cache]
+            if chunks is None:
+                return len(uncached) * np.prod(dataset_shape[1:]) * dataset.dtype.itemsize
+
+            num_chunks = len({loc // chunks[0] for loc in uncached}) * np.prod(np.ceil(dataset_shape[1:] / chunks[1:]))
+            return num_chunks * np.prod(chunks) * dataset.dtype.itemsize
+
+        if chunks is None:
+            # Trailing axes, covered entirely, make longer contiguous runs
+            shape = stops - starts
+            axis_ = len(shape) - 1
+            while axis_ > 0 and shape[axis_] == dataset_shape[axis_]:
+                axis_ -= 1
+            num_runs = np.prod(shape[:axis_])
+            return np.prod(shape) * dataset.dtype.itemsize + num_runs * self.READ_OVERHEAD
+
+        num_chunks = np.prod((stops - 1) // chunks - starts // chunks + 1)
+        return num_chunks * np.prod(chunks) * dataset.dtype.itemsize
+
+    def cheapest_projection(self, locations, mode='slide'):
+        """ Axis of the available projection with the lowest `projection_cost` of loading `locations`. """
+        costs = [self.projection_cost(locations, axis, mode=mode) for axis in self.projections]
+        return self.projections[np.argmin(costs)]
+
+    def _choose_crop_mode(self, locations, axis=None, mode='adaptive'):
+        """ Choose the cheapest combination of projection and loading mode, according to `projection_cost`. """
+        if axis is not None:
+            mapping = {0: 0, 1: 1, 2: 2,
+                       'i': 0, 'x': 1, 'h': 2,
+                       'iline': 0, 'xline': 1, 'height': 2, 'depth': 2}
+            axis = mapping[axis]
+        axes = [axis] if axis in self.projections else self.projections
+        modes = ['slide', 'crop'] if mode == 'adaptive' else [mode]
+
+        candidates = [(self.projection_cost(locations, axis_, mode=mode_), mode_, axis_)
+                      for mode_ in modes for axis_ in axes]
+        _, mode, axis = min(candidates, key=lambda item: item[0])
+        return mode, axis
+
+    def _slide_loaders(self, locations, **kwargs):
+        """ Keys and loaders of slides, used by `load_crop` at `locations`. """
+        mode, axis = self._choose_crop_mode(locations, **kwargs)
+        if mode != 'slide':
+            return []
+
+        name, order = self.PROJECTIONS[axis]
+        cube, slc = self.file_hdf5[name], locations[order[0]]
+        return [((self.path, cube.name, loc), partial(self._cached_load, cube, loc))
+                for loc in range(slc.start, slc.stop)]
+
     # Methods to load actual data from HDF5
-    def load_crop(self, locations, axis=None, **kwargs):
+    def load_crop(self, locations, axis=None, mode='adaptive', dequantize=True, out=None, **kwargs):
         """ Load 3D crop from the cube.
         Automatically chooses the fastest axis to use: as `hdf5` files store multiple copies of data with
-        various orientations, some axis are faster than others depending on exact crop location and size.
+        various orientations, some axis are faster than others depending on exact crop location and size,
+        as well as chunking of projections. Crop is either assembled from cached slides or read directly;
+        the choice depends on which slides are already in cache. Refer to `projection_cost` for details.
 
         Parameters
         locations : sequence of slices
@@ -1020,52 +1569,81 @@ class SeismicGeometryHDF5(SeismicGeometry):
         axis : str or int
             Identificator of the axis to use to load data.
             Can be `iline`, `xline`, `height`, `depth`, `i`, `x`, `h`, 0, 1, 2.
+        mode : str
+            If `adaptive`, then the way to load data is chosen automatically.
+            If `slide`, then crop is assembled from slides, stored in `slide_cache`.
+            If `crop`, then crop is read from the file with one hyperslab selection, bypassing the cache.
+        dequantize : bool
+            Whether to convert data of quantized cube to amplitudes.
+        out : ndarray, optional
+            Array of the crop shape to put loaded data into.
         """
         _ = kwargs
+        mode, axis = self._choose_crop_mode(locations, axis=axis, mode=mode)
 
-        if axis is None:
-            shape = np.array([(slc.stop - slc.start) for slc in locations])
-            axis = np.argmin(shape)
+        if mode == 'crop':
+            crop = self._load_direct(*locations, axis=axis, out=out)
+        elif axis == 1:
+            crop = self._load_x(*locations, out=out)
+        elif axis == 2:
+            crop = self._load_h(*locations, out=out)
         else:
-            mapping = {0: 0, 1: 1, 2: 2,
-                       'i': 0, 'x': 1, 'h': 2,
-                       'iline': 0, 'xline': 1, 'height': 2, 'depth': 2}
-            axis = mapping[axis]
-
-        if axis == 1 and 'cube_x' in self.file_hdf5:
-            crop = self._load_x(*locations)
-        elif axis == 2 and 'cube_h' in self.file_hdf5:
-            crop = self._load_h(*locations)
-        else: # backward compatibility
-            crop = self._load_i(*locations)
-        return crop
-
-    def _load_i(self, ilines, xlines, heights):
+            crop = self._load_i(*locations, out=out)
+        return self.dequantize(crop, out=out) if dequantize else crop
+
+    def _load_direct(self, *locations, axis=0, out=None):
+        name, order = self.PROJECTIONS[axis]
+        cube_hdf5 = self.file_hdf5[name]
+        selection = tuple(slice(locations[i].start, min(locations[i].stop, cube_hdf5.shape[j]))
+                          for j, i in enumerate(order))
+        shape = [slc.stop - slc.start for slc in selection]
+
+        # Read straight into `out`, if its memory layout and type allow it
+        if out is not None and order == (0, 1, 2) and out.dtype == cube_hdf5.dtype \
+           and out.flags.c_contiguous and list(out.shape) == shape:
+            cube_hdf5.read_direct(out, source_sel=selection)
+            return out
+
+        buffer = np.empty(shape, dtype=cube_hdf5.dtype)
+        cube_hdf5.read_direct(buffer, source_sel=selection)
+        buffer = buffer.transpose(np.argsort(order))
+        if out is not None:
+            out[...] = buffer
+            return out
+        return buffer
+
+    def _load_i(self, ilines, xlines, heights, out=None):
         cube_hdf5 = self.file_hdf5['cube']
         return np.stack([self._cached_load(cube_hdf5, iline)[xlines, :][:, heights]
-                         for iline in range(ilines.start, ilines.stop)])
+                         for iline in range(ilines.start, ilines.stop)], out=out)
 
-    def _load_x(self, ilines, xlines, heights):
+    def _load_x(self, ilines, xlines, heights, out=None):
         cube_hdf5 = self.file_hdf5['cube_x']
         return np.stack([self._cached_load(cube_hdf5, xline)[heights, :][:, ilines].transpose([1, 0])
-                         for xline in range(xlines.start, xlines.stop)], axis=1)
+                         for xline in range(xlines.start, xlines.stop)], axis=1, out=out)
 
-    def _load_h(self, ilines, xlines, heights):
+    def _load_h(self, ilines, xlines, heights, out=None):
         cube_hdf5 = self.file_hdf5['cube_h']
         return np.stack([self._cached_load(cube_hdf5, height)[ilines, :][:, xlines]
-                         for height in range(heights.start, heights.stop)], axis=2)
+                         for height in range(heights.start, heights.stop)], axis=2, out=out)
 
-    @lru_cache(128)
     def _cached_load(self, cube, loc):
         """ Load one slide of data from a certain cube projection.
-        Caches the result in a thread-safe manner.
+        Caches the result in a thread-safe manner in `slide_cache`.
         """
-        return cube[loc, :, :]
+        return self.slide_cache.get(self.path, cube.name, loc, lambda: cube[loc, :, :])
 
-    def load_slide(self, loc, axis='iline', **kwargs):
-        """ Load desired slide along desired axis. """
+    def load_slide(self, loc, axis='iline', dequantize=True, **kwargs):
+        """ Load desired slide along desired axis.
+        If the projection along `axis` is not stored in the file, slide is assembled from the other ones.
+        """
         _ = kwargs
         axis = self.parse_axis(axis)
+        if axis not in self.projections:
+            locations = [slice(0, item) for item in self.cube_shape]
+            locations[axis] = slice(loc, loc + 1)
+            return self.load_crop(locations, dequantize=dequantize).squeeze(axis=axis)
+
         if axis == 0:
             cube = self.file_hdf5['cube']
             slide = self._cached_load(cube, loc)
@@ -1075,7 +1653,7 @@ class SeismicGeometryHDF5(SeismicGeometry):
         elif axis == 2:
             cube = self.file_hdf5['cube_h']
             slide = self._cached_load(cube, loc)
-        return slide
+        return self.dequantize(slide) if dequantize else slide
 
 
     def __getitem__(self, key):
@@ -1096,15 +1674,133 @@ class SeismicGeometryHDF5(SeismicGeometry):
                 squeeze.append(i)
             key.append(slc)
 
-        shape = [(slc.stop - slc.start) for slc in key]
-        axis = np.argmin(shape)
-        if axis == 0:
-            crop = self.file_hdf5['cube'][key[0], key[1], key[2]]
-        elif axis == 1:
-            crop = self.file_hdf5['cube_x'][key[1], key[2], key[0]].transpose((2, 0, 1))
-        elif axis == 2:
-            crop = self.file_hdf5['cube_h'][key[2], key[0], key[1]].transpose((1, 2, 0))
+        shape = np.array([(slc.stop - slc.start) for slc in key])
+        axis = min(self.projections, key=lambda item: shape[item])
+        name, order = self.PROJECTIONS[axis]
+        crop = self.file_hdf5[name][tuple(key[item] for item in order)].transpose(np.argsort(order))
+        crop = self.dequantize(crop)
 
         if squeeze:
             crop = np.squeeze(crop, axis=tuple(squeeze))
         return crop
+
+
+
+def _collect_stats_chunked(path, start, stop, bins, chunk_size, num_keep, seed, segyfile=None, pbar=None):
+    """ Collect per-trace stats for traces in `start:stop` range of a SEG-Y file.
+    Traces are read in contiguous blocks of `chunk_size` traces. If `segyfile` is not provided,
+    the file is opened (and memory mapped) inside, so the function can be used as a target for a process pool.
+    """
+    opened = segyfile is None
+    if opened:
+        segyfile = segyio.open(path, 'r', strict=False, ignore_geometry=True)
+        segyfile.mmap()
+
+    rng = np.random.default_rng(seed)
+    depth = len(segyfile.samples)
+    num_traces = stop - start
+
+    result = {
+        'min': np.empty(num_traces, dtype=np.float32),
+        'max': np.empty(num_traces, dtype=np.float32),
+        'sum': np.empty(num_traces, dtype=np.float64),
+        'sumsq': np.empty(num_traces, dtype=np.float64),
+        'hist': np.empty((num_traces, len(bins) - 1), dtype=np.int32),
+    }
+    container = np.zeros((num_keep, depth), dtype=np.float32)
+    seen = 0
+
+    iterator = range(start, stop, chunk_size)
+    if pbar:
+        iterator = tqdm(iterator, desc=pbar, ncols=1000)
+
+    for chunk_start in iterator:
+        chunk_stop = min(chunk_start + chunk_size, stop)
+        traces = segyfile.trace.raw[chunk_start:chunk_stop].reshape(-1, depth)
+
+        slc = slice(chunk_start - start, chunk_stop - start)
+        _trace_stats(traces, bins, result['min'][slc], result['max'][slc],
+                     result['sum'][slc], result['sumsq'][slc], result['hist'][slc])
+
+        # Reservoir sampling of non-constant traces
+        candidates = np.nonzero(result['min'][slc] != result['max'][slc])[0]
+        draws = rng.integers(0, np.arange(seen + 1, seen + len(candidates) + 1))
+        seen = _update_reservoir(container, seen, traces, candidates, draws)
+
+    if opened:
+        segyfile.close()
+
+    result['container'] = container[:min(seen, num_keep)]
+    result['seen'] = seen
+    return result
+
+@njit(parallel=True)
+def _trace_stats(traces, bins, min_array, max_array, sum_array, sumsq_array, hist_array):
+    """ Compute min, max, sum, sum of squares and histogram of each trace in one pass through it.
+    Values outside of `bins` range are counted in the outermost bins.
+    """
+    #pylint: disable=not-an-iterable
+    n_bins = len(bins) - 1
+    for i in prange(traces.shape[0]):
+        trace = traces[i]
+        min_val = max_val = trace[0]
+        sum_val = sumsq_val = 0.0
+        hist_array[i, :] = 0
+
+        positions = np.searchsorted(bins, trace, side='right') - 1
+        for j in range(trace.shape[0]):
+            value = trace[j]
+            min_val = min(min_val, value)
+            max_val = max(max_val, value)
+            sum_val += value
+            sumsq_val += value * value
+
+            position = min(max(positions[j], 0), n_bins - 1)
+            hist_array[i, position] += 1
+
+        min_array[i], max_array[i] = min_val, max_val
+        sum_array[i], sumsq_array[i] = sum_val, sumsq_val
+
+@njit
+def _update_reservoir(container, seen, traces, candidates, draws):
+    """ Algorithm R: each of the candidate traces replaces random element of the full reservoir with probability
+    `num_keep / seen`. Draws are precomputed positions in `[0, seen)` range for each of the candidates.
+    """
+    num_keep = container.shape[0]
+    for k, idx in enumerate(candidates):
+        if seen < num_keep:
+            container[seen] = traces[idx]
+        elif draws[k] < num_keep:
+            container[draws[k]] = traces[idx]
+        seen += 1
+    return seen
+
+def _merge_reservoirs(containers, seens, num_keep):
+    """ Merge reservoirs, collected on disjoint ranges of traces, into one uniform sample. """
+    seens = np.array(seens, dtype=np.float64)
+    if len(containers) == 1 or seens.sum() == 0:
+        return containers[0]
+
+    # Number of traces to take from each reservoir is proportional to the amount of traces it has seen
+    total = int(min(num_keep, seens.sum()))
+    counts = np.random.multinomial(total, seens / seens.sum())
+    counts = np.minimum(counts, [len(container) for container in containers])
+
+    parts = [container[np.random.choice(len(container), size=count, replace=False)]
+             for container, count in zip(containers, counts) if count > 0]
+    return np.concatenate(parts)
+
+
+@njit(parallel=True)
+def _ibm_to_ieee(array):
+    """ Convert IBM floats, stored as (native) uint32, to IEEE float32. """
+    #pylint: disable=not-an-iterable
+    flat = array.ravel()
+    result = np.empty(flat.shape, dtype=np.float32)
+    for i in prange(flat.shape[0]):
+        value = flat[i]
+        mantissa = value & 0x00ffffff
+        exponent = (value >> 24) & 0x7f
+        sign = -1.0 if value >> 31 else 1.0
+        result[i] = sign * np.ldexp(np.float64(mantissa), 4 * (np.int64(exponent) - 64) - 24)
+    return result.reshape(array.shape)
@@ -2,25 +2,48 @@
 #pylint: disable=too-many-lines, import-error
 import os
 from copy import copy
+from collections import defaultdict
 from itertools import product
 from textwrap import dedent
+from warnings import warn
 
 import numpy as np
 import pandas as pd
+import h5py
 from numba import njit, prange
 
 import cv2
 from scipy.ndimage.morphology import binary_fill_holes, binary_erosion
-from scipy.ndimage import find_objects
 from skimage.measure import label
 
 from ..batchflow import HistoSampler
 
-from .utils import round_to_array, groupby_mean, groupby_min, groupby_max
+from .utils import round_to_array, read_point_cloud
 from .plotters import plot_image
 
 
 
+class CachedMatrix(property):
+    """ Property, that is computed once for each version of horizon data.
+    Computed arrays are stored in the `_cache` of the instance and are made read-only, as they are shared.
+    """
+    def __init__(self, method):
+        name = method.__name__
+
+        def getter(instance):
+            #pylint: disable=protected-access
+            version, value = instance._cache.get(name, (None, None))
+            if version != instance._version:
+                value = method(instance)
+                if isinstance(value, np.ndarray):
+                    value.flags.writeable = False
+                instance._cache[name] = (instance._version, value)
+            return value
+        super().__init__(getter)
+        self.__doc__ = method.__doc__
+
+
+
 class UnstructuredHorizon:
     """  Contains unstructured horizon.
 
@@ -119,7 +142,8 @@ class UnstructuredHorizon:
         height_prefix : str
             Column name with height.
         reader_params : None or dict
-            Additional parameters for file reader.
+            Additional parameters for file reader. If provided, file is read by `pd.read_csv`.
+            Otherwise, by a faster `read_point_cloud`.
         """
         #pylint: disable=anomalous-backslash-in-string
         _ = kwargs
@@ -135,10 +159,13 @@ class UnstructuredHorizon:
         self.path = path
         self.name = os.path.basename(path)
 
-        defaults = {'sep': '\s+'}
-        reader_params = reader_params or {}
-        reader_params = {**defaults, **reader_params}
-        df = pd.read_csv(path, names=names, usecols=columns, **reader_params)
+        if reader_params is None:
+            values = read_point_cloud(path, usecols=[names.index(column) for column in columns])
+            df = pd.DataFrame(values, columns=columns)
+        else:
+            defaults = {'sep': '\s+'}
+            reader_params = {**defaults, **reader_params}
+            df = pd.read_csv(path, names=names, usecols=columns, **reader_params)
 
         # Convert coordinates of horizons to the one that present in cube geometry
         # df[columns] = np.rint(df[columns]).astype(np.int64)
@@ -299,6 +326,7 @@ class Horizon:
 
     Storage can be one of:
         - csv-like file in CHARISMA or REDUCED_CHARISMA format.
+        - `.hdf5` file with depth map, made by `dump_binary` method.
         - ndarray of (N, 3) shape.
         - ndarray of (ilines_len, xlines_len) shape.
         - dictionary: a mapping from (iline, xline) -> height.
@@ -338,6 +366,7 @@ class Horizon:
          for more metrics, check :class:`~.HorizonMetrics`.
 
         - A number of properties that describe geometrical, geological and mathematical characteristics of a horizon.
+          Derived matrices are computed once and cached until the horizon is changed: check `cache_info`.
           For example, `borders_matrix` and `boundaries_matrix`: the latter containes outer and inner borders;
           `coverage` is the ratio between labeled traces and non-zero traces in the seismic cube;
           `solidity` is the ratio between labeled traces and traces inside the hull of the horizon;
@@ -348,7 +377,7 @@ class Horizon:
 
         - A wealth of visualization methods: view from above, slices along iline/xline axis, etc.
     """
-    #pylint: disable=too-many-public-methods, import-outside-toplevel
+    #pylint: disable=too-many-public-methods, too-many-instance-attributes, import-outside-toplevel
 
     # CHARISMA: default seismic format of storing surfaces inside the 3D volume
     CHARISMA_SPEC = ['INLINE', '_', 'iline', 'XLINE', '__', 'xline', 'cdp_x', 'cdp_y', 'height']
@@ -362,6 +391,15 @@ class Horizon:
     # Value to place into blank spaces
     FILL_VALUE = -999999
 
+    # Extensions of files, made by `dump_binary`
+    BINARY_EXTENSIONS = ['.hdf5', '.h5']
+
+    # Whether to keep parsed values of text files in hidden files next to them: see `read_point_cloud`
+    CACHE_POINT_CLOUDS = False
+
+    # Attributes of geometry, that must be the same for a horizon to be loaded from binary file
+    GEOMETRY_FINGERPRINT = ['cube_shape', 'ilines_offset', 'xlines_offset', 'delay', 'sample_rate']
+
     def __init__(self, storage, geometry, name=None, **kwargs):
         # Meta information
         self.path = None
@@ -379,6 +417,11 @@ class Horizon:
         self._matrix = None
         self._points = None
         self._depths = None
+        self.attributes = {}
+
+        # Derived matrices are cached for the current version of data
+        self._version = 0
+        self._cache = {}
 
         # Heights information
         self._h_min, self._h_max = None, None
@@ -393,7 +436,11 @@ class Horizon:
         self.sampler = None
 
         # Check format of storage, then use it to populate attributes
-        if isinstance(storage, str):
+        if isinstance(storage, str) and os.path.splitext(storage)[1] in self.BINARY_EXTENSIONS:
+            # path to binary file with depth map
+            self.format = 'binary'
+
+        elif isinstance(storage, str):
             # path to csv-like file
             self.format = 'file'
 
@@ -431,6 +478,7 @@ class Horizon:
     @points.setter
     def points(self, value):
         self._points = value
+        self._version += 1
 
     @staticmethod
     def matrix_to_points(matrix):
@@ -456,6 +504,7 @@ class Horizon:
     @matrix.setter
     def matrix(self, value):
         self._matrix = value
+        self._version += 1
 
     @staticmethod
     def points_to_matrix(points, i_min, x_min, i_length, x_length):
@@ -513,7 +562,8 @@ class Horizon:
         return self._len
 
     def reset_storage(self, storage=None):
-        """ Reset storage along with depth-wise stats."""
+        """ Reset storage along with depth-wise stats and cached derived matrices."""
+        self._version += 1
         self._depths = None
         self._h_min, self._h_max = None, None
         self._h_mean, self._h_std = None, None
@@ -524,6 +574,16 @@ class Horizon:
         elif storage == 'points':
             self._points = None
 
+    def reset_cache(self):
+        """ Remove all cached derived matrices. """
+        self._cache = {}
+
+    @property
+    def cache_info(self):
+        """ Mapping from names of cached derived matrices to their sizes in bytes. """
+        return {name: getattr(value, 'nbytes', 0) for name, (version, value) in self._cache.items()
+                if version == self._version}
+
     # Coordinate transforms
     def lines_to_cubic(self, array):
         """ Convert ilines-xlines to cubic coordinates system. """
@@ -583,18 +643,24 @@ class Horizon:
                              dtype=np.int32)
 
 
-    def from_file(self, path, transform=True, **kwargs):
-        """ Init from path to either CHARISMA or REDUCED_CHARISMA csv-like file. """
+    def from_file(self, path, transform=True, cache=None, **kwargs):
+        """ Init from path to either CHARISMA or REDUCED_CHARISMA csv-like file.
+        If `cache` is None, then `CACHE_POINT_CLOUDS` is used.
+        """
         _ = kwargs
 
         self.path = path
         self.name = os.path.basename(path)
-        points = self.file_to_points(path)
+        points = self.file_to_points(path, cache=cache)
         self.from_points(points, transform)
 
-    def file_to_points(self, path):
-        """ Get point cloud array from file values. """
-        #pylint: disable=anomalous-backslash-in-string
+    def file_to_points(self, path, cache=None):
+        """ Get point cloud array from file values.
+        Only `COLUMNS` of the file are parsed; if `cache`, they are also stored in a hidden `.npz` file
+        next to the original one, so that subsequent loads of the same file are almost instant.
+        If `cache` is None, then `CACHE_POINT_CLOUDS` is used.
+        """
+        cache = self.CACHE_POINT_CLOUDS if cache is None else cache
         with open(path) as file:
             line_len = len(file.readline().split(' '))
         if line_len == 3:
@@ -604,9 +670,8 @@ class Horizon:
         else:
             raise ValueError('Horizon labels must be in CHARISMA or REDUCED_CHARISMA format.')
 
-        df = pd.read_csv(path, sep='\s+', names=names, usecols=Horizon.COLUMNS)
-        df.sort_values(Horizon.COLUMNS, inplace=True)
-        return df.values
+        points = read_point_cloud(path, usecols=[names.index(column) for column in Horizon.COLUMNS], cache=cache)
+        return points[np.lexsort(points.T[::-1])]
 
 
     def from_matrix(self, matrix, i_min, x_min, length=None, **kwargs):
@@ -632,6 +697,44 @@ class Horizon:
         self.from_matrix(matrix, 0, 0, **kwargs)
 
 
+    def from_binary(self, path, mmap=True, **kwargs):
+        """ Init from `.hdf5` file, made by `dump_binary` method.
+
+        Parameters
+        ----------
+        path : str
+            Path to the file.
+        mmap : bool
+            Whether to map the stored `int32` depth map into memory instead of reading it.
+            Changes of the matrix are not written to the file.
+        """
+        _ = kwargs
+
+        with h5py.File(path, mode='r') as file:
+            for attribute in self.GEOMETRY_FINGERPRINT:
+                if not np.allclose(file.attrs[attribute], getattr(self.geometry, attribute)):
+                    raise ValueError(f'Horizon in {path} was dumped for a different geometry: '
+                                     f'`{attribute}` is {file.attrs[attribute]} instead of '
+                                     f'{getattr(self.geometry, attribute)}.')
+
+            dataset = file['matrix']
+            fill_value = dataset.attrs['fill_value']
+            offset = dataset.id.get_offset()
+
+            if mmap and offset is not None and dataset.dtype == np.int32 and fill_value == self.FILL_VALUE:
+                matrix = np.memmap(path, mode='c', dtype=dataset.dtype, offset=offset, shape=dataset.shape)
+            else:
+                matrix = dataset[()].astype(np.int32)
+                matrix[matrix == fill_value] = self.FILL_VALUE
+
+            self.attributes = {key: value[()] for key, value in file.get('attributes', {}).items()}
+            self.from_matrix(matrix, int(file.attrs['i_min']), int(file.attrs['x_min']),
+                             length=int(file.attrs['length']))
+
+        self.path = path
+        self.name = self.name or os.path.splitext(os.path.basename(path))[0]
+
+
     def from_dict(self, dictionary, transform=True, **kwargs):
         """ Init from mapping from (iline, xline) to depths. """
         _ = kwargs
@@ -649,7 +752,7 @@ class Horizon:
 
     @staticmethod
     def from_mask(mask, grid_info=None, geometry=None, shifts=None,
-                  mode='mean', threshold=0.5, minsize=0, prefix='predict', **kwargs):
+                  mode='mean', threshold=0.5, minsize=0, prefix='predict', chunk_size=None, **kwargs):
         """ Convert mask to a list of horizons.
         Returned list is sorted on length of horizons.
 
@@ -667,6 +770,11 @@ class Horizon:
             Minimum length of a horizon to be saved.
         prefix : str
             Name of horizon to use.
+        chunk_size : int, optional
+            If provided, then mask is processed in chunks of that many ilines, overlapping by one iline,
+            and surfaces from successive chunks are merged. Then `minsize` is compared to the lengths of merged
+            horizons. Allows to use any object that supports slicing as mask, for example,
+            a memory mapped array or :class:`.Accumulator3D`.
         """
         _ = kwargs
         if grid_info is not None:
@@ -676,35 +784,63 @@ class Horizon:
         if geometry is None or shifts is None:
             raise TypeError('Pass `grid_info` or `geometry` and `shifts` to `from_mask` method of Horizon creation.')
 
-        if mode in ['mean', 'avg']:
-            group_function = groupby_mean
-        elif mode in ['min']:
-            group_function = groupby_min
-        elif mode in ['max']:
-            group_function = groupby_max
+        if chunk_size is None:
+            horizons = [Horizon(points, geometry, name=f'{prefix}_{i}')
+                        for i, points in Horizon.mask_to_points(mask, shifts=shifts, mode=mode,
+                                                                threshold=threshold, minsize=minsize)]
+        else:
+            # Surfaces, cut by the border between chunks, overlap on the shared iline
+            # Fragments that touch neither of them can't be merged, so they are filtered by `minsize` right away
+            index = HorizonIndex(mean_threshold=1.0, adjacency=0)
+            for start in range(0, mask.shape[0], chunk_size):
+                chunk = np.asarray(mask[start:start + chunk_size + 1])
+                chunk_shifts = np.asarray(shifts) + np.array([start, 0, 0])
+                first = chunk_shifts[0] if start > 0 else None
+                last = chunk_shifts[0] + len(chunk) - 1 if start + len(chunk) < mask.shape[0] else None
+
+                for _, points in Horizon.mask_to_points(chunk, shifts=chunk_shifts, mode=mode, threshold=threshold):
+                    if len(points) < minsize and points[0, 0] != first and points[-1, 0] != last:
+                        continue
+                    index.merge(Horizon(points, geometry))
+
+            horizons = [horizon for horizon in index if len(horizon) >= minsize]
+            for i, horizon in enumerate(horizons):
+                horizon.name = f'{prefix}_{i}'
 
-        # Labeled connected regions with an integer
-        labeled = label(mask >= threshold)
-        objects = find_objects(labeled)
+        horizons.sort(key=len)
+        return horizons
 
-        # Create an instance of Horizon for each separate region
-        horizons = []
-        for i, sl in enumerate(objects):
-            max_possible_length = 1
-            for j in range(3):
-                max_possible_length *= sl[j].stop - sl[j].start
+    @staticmethod
+    def mask_to_points(mask, shifts, mode='mean', threshold=0.5, minsize=0):
+        """ Points of horizons from separate connected regions of the mask.
+        Does not require geometry, so can be run in worker processes; refer to `from_mask` for parameters.
 
-            if max_possible_length >= minsize:
-                indices = np.nonzero(labeled[sl] == i + 1)
+        Returns
+        -------
+        list of tuples
+            Number of region and its points in cube coordinates.
+        """
+        mode = {'mean': 0, 'avg': 0, 'min': 1, 'max': 2}[mode]
 
-                if len(indices[0]) >= minsize:
-                    coords = np.vstack([indices[i] + sl[i].start for i in range(3)]).T
+        # Labeled connected regions with an integer: voxels of each region are made contiguous by one sort.
+        # Stable sort keeps the (iline, xline, height) order of voxels inside each of the regions
+        labeled, num_labels = _label_regions(np.asarray(mask), threshold)
+        labeled = labeled.ravel()
+        positions = np.flatnonzero(labeled)
+        labels = labeled[positions]
+        order = np.argsort(labels, kind='stable')
+        positions = positions[order]
 
-                    points = group_function(coords) + shifts
-                    horizons.append(Horizon(points, geometry, name=f'{prefix}_{i}'))
+        sizes = np.bincount(labels, minlength=num_labels + 1)[1:]
+        ends = np.cumsum(sizes)
+        starts = ends - sizes
+        keep = np.flatnonzero(sizes >= max(minsize, 1))
 
-        horizons.sort(key=len)
-        return horizons
+        # Create points of horizon for each kept region in one parallel pass
+        coords = np.stack(np.unravel_index(positions, mask.shape), axis=1)
+        points, offsets = _group_regions(coords, starts[keep], ends[keep], mode)
+        points = points + shifts
+        return [(i, points[offsets[k]:offsets[k + 1]]) for k, i in enumerate(keep)]
 
 
     # Functions to use to change the horizon
@@ -909,8 +1045,10 @@ class Horizon:
         return mask
 
 
-    def get_cube_values(self, window=23, offset=0, scale=False, chunk_size=256):
+    def get_cube_values(self, window=23, offset=0, scale=False, tile_memory=256*1024**2, on_full=True,
+                        chunk_size=None):
         """ Get values from the cube along the horizon.
+        Data is read in spatial tiles over the bounding box of the horizon: check :meth:`.iterate_cube_values`.
 
         Parameters
         ----------
@@ -920,15 +1058,52 @@ class Horizon:
             Value to add to each entry in matrix.
         scale : bool, callable
             If True, then values are scaled to [0, 1] range.
-            If callable, then it is applied to iline-oriented slices of data from the cube.
-        chunk_size : int
-            Size of data along height axis processed at a time.
+            If callable, then it is applied to tiles of data from the cube.
+        tile_memory : int
+            Maximum size of data (in bytes) read from the cube at a time.
+        on_full : bool
+            If True, then values are placed on the array of `(ilines_len, xlines_len, window)` shape.
+            Otherwise, the array covers only the bounding box of the horizon.
+        chunk_size : int, optional
+            Deprecated: use `tile_memory` instead.
         """
-        low = window // 2
-        high = max(window - low, 0)
-        chunk_size = min(chunk_size, self.h_max - self.h_min + window)
+        if chunk_size is not None:
+            # Data was read in chunks of `chunk_size` depths over the whole bounding box of the horizon
+            warn('`chunk_size` is deprecated, use `tile_memory` instead', DeprecationWarning, stacklevel=2)
+            tile_memory = chunk_size * self.i_length * self.x_length * 4
+
+        shape = self.cube_shape[:2] if on_full else (self.i_length, self.x_length)
+        shift_i, shift_x = (0, 0) if on_full else (self.i_min, self.x_min)
+        background = np.zeros((*shape, window), dtype=np.float32)
+
+        for (slice_i, slice_x), values in self.iterate_cube_values(window=window, offset=offset, scale=scale,
+                                                                   tile_memory=tile_memory):
+            background[slice_i.start - shift_i : slice_i.stop - shift_i,
+                       slice_x.start - shift_x : slice_x.stop - shift_x] = values
+
+        zero_traces = self.geometry.zero_traces
+        if not on_full:
+            zero_traces = zero_traces[self.i_min:self.i_max + 1, self.x_min:self.x_max + 1]
+        background[zero_traces == 1] = np.nan
+        return background
+
+    def iterate_cube_values(self, window=23, offset=0, scale=False, tile_memory=256*1024**2):
+        """ Generate values from the cube along the horizon, tile by tile.
+        Bounding box of the horizon is split into spatial tiles so that data for each of them takes
+        no more than `tile_memory` bytes, and only the depth range, required for the tile, is read from the cube.
 
-        background = np.zeros((self.geometry.ilines_len, self.geometry.xlines_len, window), dtype=np.float32)
+        Parameters
+        ----------
+        window, offset, scale, tile_memory
+            Same as in :meth:`.get_cube_values`.
+
+        Yields
+        ------
+        (slice, slice), np.ndarray
+            Location of the tile in cubic coordinates and values of `(tile_ilines, tile_xlines, window)` shape.
+            Points without horizon are filled with zeros.
+        """
+        low = window // 2
 
         # Make callable scaler
         if callable(scale):
@@ -938,31 +1113,37 @@ class Horizon:
         elif scale is False:
             scale = lambda array: array
 
-        for h_start in range(max(low, self.h_min), self.h_max, chunk_size):
-            h_end = min(h_start + chunk_size, self.h_max + 1)
-
-            # Get chunk from the cube (depth-wise)
-            data_chunk = self.geometry[:, :, (h_start - low) : min(h_end + high, self.geometry.depth)]
-            data_chunk = scale(data_chunk)
-
-            # Check which points of the horizon are in the current chunk (and present)
-            idx_i, idx_x = np.asarray((self.matrix != self.FILL_VALUE) &
-                                      (self.matrix >= h_start) &
-                                      (self.matrix < h_end)).nonzero()
-            heights = self.matrix[idx_i, idx_x]
-
-            # Convert spatial coordinates to cubic, convert height to current chunk local system
-            idx_i += self.i_min
-            idx_x += self.x_min
-            heights -= (h_start - offset)
-
-            # Subsequently add values from the cube to background, then shift horizon 1 unit lower
-            for j in range(window):
-                background[idx_i, idx_x, np.full_like(heights, j)] = data_chunk[idx_i, idx_x, heights]
-                heights += 1
-
-        background[self.geometry.zero_traces == 1] = np.nan
-        return background
+        # Depth range of the whole horizon is the upper bound for the depth range of any tile
+        band = self.h_max - self.h_min + window
+        tile_i = int(np.clip(np.sqrt(tile_memory / (4 * band)), 1, self.i_length))
+        tile_x = int(np.clip(tile_memory // (4 * band * tile_i), 1, self.x_length))
+
+        for i_start in range(0, self.i_length, tile_i):
+            for x_start in range(0, self.x_length, tile_x):
+                matrix = self.matrix[i_start:i_start + tile_i, x_start:x_start + tile_x]
+                slices = (slice(self.i_min + i_start, self.i_min + i_start + matrix.shape[0]),
+                          slice(self.x_min + x_start, self.x_min + x_start + matrix.shape[1]))
+                values = np.zeros((*matrix.shape, window), dtype=np.float32)
+
+                # Depth of the first value to cut for each present point
+                idx_i, idx_x = np.asarray(matrix != self.FILL_VALUE).nonzero()
+                heights = matrix[idx_i, idx_x] + (offset - low)
+                if len(heights) == 0:
+                    yield slices, values
+                    continue
+
+                h_start = max(heights.min(), 0)
+                h_end = min(heights.max() + window, self.geometry.depth)
+                if h_end > h_start:
+                    data = scale(self.geometry[slices[0], slices[1], h_start:h_end])
+                    heights -= h_start
+
+                    # Subsequently add values from the cube, then shift horizon 1 unit lower
+                    for j in range(window):
+                        inside = (heights >= 0) & (heights < data.shape[-1])
+                        values[idx_i[inside], idx_x[inside], j] = data[idx_i[inside], idx_x[inside], heights[inside]]
+                        heights += 1
+                yield slices, values
 
     def get_cube_values_line(self, orientation='ilines', line=1, window=23, offset=0, scale=False):
         """ Get values from the cube along the horizon on a particular line.
@@ -1047,12 +1228,12 @@ class Horizon:
         amplitudes[self.full_matrix == self.FILL_VALUE] = np.nan
         return amplitudes
 
-    @property
+    @CachedMatrix
     def binary_matrix(self):
         """ Matrix with ones at places where horizon is present and zeros everywhere else. """
         return (self.matrix > 0).astype(bool)
 
-    @property
+    @CachedMatrix
     def borders_matrix(self):
         """ Borders of horizons (borders of holes inside are not included). """
         filled_matrix = self.filled_matrix
@@ -1060,7 +1241,7 @@ class Horizon:
         eroded = binary_erosion(filled_matrix, structure, border_value=0)
         return filled_matrix ^ eroded # binary difference operation
 
-    @property
+    @CachedMatrix
     def boundaries_matrix(self):
         """ Borders of horizons (borders of holes inside included). """
         binary_matrix = self.binary_matrix
@@ -1073,24 +1254,24 @@ class Horizon:
         """ Ratio between number of present values and number of good traces in cube. """
         return len(self) / (np.prod(self.cube_shape[:2]) - np.sum(self.geometry.zero_traces))
 
-    @property
+    @CachedMatrix
     def filled_matrix(self):
         """ Binary matrix with filled holes. """
         structure = np.ones((3, 3))
         filled_matrix = binary_fill_holes(self.binary_matrix, structure)
         return filled_matrix
 
-    @property
+    @CachedMatrix
     def full_matrix(self):
         """ Matrix in cubic coordinate system. """
         return self.put_on_full()
 
-    @property
+    @CachedMatrix
     def grad_i(self):
         """ Change of heights along iline direction. """
         return self.grad_along_axis(0)
 
-    @property
+    @CachedMatrix
     def grad_x(self):
         """ Change of heights along xline direction. """
         return self.grad_along_axis(1)
@@ -1415,46 +1596,15 @@ class Horizon:
 
     @staticmethod
     def merge_list(horizons, mean_threshold=2.0, adjacency=3, minsize=50):
-        """ Iteratively try to merge every horizon in a list to every other, until there are no possible merges.
+        """ Merge every horizon in a list to every other, until there are no possible merges.
+        Only pairs of horizons that are close spatially and depth-wise are checked: refer to :class:`.HorizonIndex`.
         Parameters are passed directly to `:meth:~.verify_merge`, `:meth:~.overlap_merge` and `:meth:~.adjacent_merge`.
         """
-        horizons = [horizon for horizon in horizons if len(horizon) >= minsize]
-
-        # Iterate over the list of horizons to merge everything that can be merged
-        i = 0
-        flag = True
-        while flag:
-            # Continue while at least one pair of horizons was merged at previous iteration
-            flag = False
-            while True:
-                if i >= len(horizons):
-                    break
-
-                j = i + 1
-                while True:
-                    # Attempt to merge j-th horizon to i-th horizon
-                    if j >= len(horizons):
-                        break
-
-                    merge_code, _ = Horizon.verify_merge(horizons[i], horizons[j],
-                                                         mean_threshold=mean_threshold,
-                                                         adjacency=adjacency)
-                    if merge_code == 3:
-                        merged = Horizon.overlap_merge(horizons[i], horizons[j], inplace=True)
-                    elif merge_code == 2:
-                        merged = Horizon.adjacent_merge(horizons[i], horizons[j], inplace=True,
-                                                        mean_threshold=mean_threshold,
-                                                        adjacency=adjacency)
-                    else:
-                        merged = False
-
-                    if merged:
-                        _ = horizons.pop(j)
-                        flag = True
-                    else:
-                        j += 1
-                i += 1
-        return horizons
+        index = HorizonIndex(mean_threshold=mean_threshold, adjacency=adjacency)
+        for horizon in horizons:
+            if len(horizon) >= minsize:
+                index.add(horizon)
+        return list(index.merge_stored())
 
 
 
@@ -1479,6 +1629,52 @@ class Horizon:
         path = path if not add_height else f'{path}_#{round(self.h_mean, 1)}'
         df.to_csv(path, sep=' ', columns=self.COLUMNS, index=False, header=False)
 
+    @classmethod
+    def binary_path(cls, path):
+        """ Path to binary version of a horizon file. """
+        return path if os.path.splitext(path)[1] in cls.BINARY_EXTENSIONS else f'{path}.hdf5'
+
+    def dump_binary(self, path, dtype=np.int32, attributes=None):
+        """ Save depth map of the horizon with its location and fingerprint of the geometry to `.hdf5` file.
+        Unlike `dump`, no conversion to points is needed; `int32` depth map can be memory mapped on load.
+
+        Parameters
+        ----------
+        path : str
+            Path to a file to save horizon to. If it is not `.hdf5` already, this extension is appended.
+        dtype : np.int32 or np.int16
+            Type of stored depths. In case of `int16`, minimum value of the type is used for absent points.
+        attributes : dict, optional
+            Mapping from names to arrays of additional horizon-related data, for example, amplitudes.
+
+        Returns
+        -------
+        str
+            Path of the saved file.
+        """
+        path = self.binary_path(path)
+        fill_value = self.FILL_VALUE if np.dtype(dtype) == np.int32 else np.iinfo(dtype).min
+        if self.h_max > np.iinfo(dtype).max:
+            raise ValueError(f'Depths of horizon do not fit into {np.dtype(dtype)}.')
+
+        matrix = self.matrix.astype(dtype)
+        matrix[self.matrix == self.FILL_VALUE] = fill_value
+
+        with h5py.File(path, mode='w') as file:
+            dataset = file.create_dataset('matrix', data=matrix)
+            dataset.attrs['fill_value'] = fill_value
+
+            file.attrs['name'] = self.name or ''
+            file.attrs['cube_name'] = self.cube_name
+            file.attrs['i_min'], file.attrs['x_min'] = self.i_min, self.x_min
+            file.attrs['length'] = len(self)
+            for attribute in self.GEOMETRY_FINGERPRINT:
+                file.attrs[attribute] = getattr(self.geometry, attribute)
+
+            for key, value in (attributes or {}).items():
+                file.create_dataset(f'attributes/{key}', data=value)
+        return path
+
 
     # Methods of (visual) representation of a horizon
     def __repr__(self):
@@ -1648,6 +1844,154 @@ class StructuredHorizon(Horizon):
     """ Convenient alias for `Horizon` class. """
 
 
+
+class HorizonIndex:
+    """ Collection of horizons, that merges new ones to the stored ones.
+    Horizons are indexed by a grid of spatial buckets: each horizon is registered in buckets that are covered
+    by its bounding box, enlarged by `adjacency`. That allows to check only the pairs of horizons, that are
+    close enough both spatially and depth-wise to be merged, instead of every pair.
+
+    Can be used as `dst` of :meth:`~.SeismicCropBatch.masks_to_horizons` to accumulate predicted horizons
+    between batches, for example, from a pipeline variable::
+        .init_variable('predicted_horizons', default=HorizonIndex())
+        .masks_to_horizons(src='predicted_masks', dst=V('predicted_horizons'))
+
+    Parameters
+    ----------
+    mean_threshold : number
+        Height threshold for mean distances. Passed to merge methods of :class:`.Horizon`.
+    adjacency : int
+        Margin to consider horizons close (spatially). Passed to merge methods of :class:`.Horizon`.
+    bucket_size : int
+        Spatial size of buckets.
+    """
+    def __init__(self, horizons=None, mean_threshold=2.0, adjacency=3, bucket_size=64):
+        self.mean_threshold, self.adjacency = mean_threshold, adjacency
+        self.bucket_size = bucket_size
+
+        self.horizons = {}
+        self.keys = {}
+        self.buckets = defaultdict(set)
+        self.numbers, self.counter = {}, 0
+
+        for horizon in horizons or []:
+            self.merge(horizon)
+
+    def __len__(self):
+        return len(self.horizons)
+
+    def __iter__(self):
+        return iter(list(self.horizons.values()))
+
+    def _bucket_keys(self, horizon, margin=0):
+        """ Buckets, covered by the bounding box of a horizon, enlarged by `margin`. """
+        i_range = range((horizon.i_min - margin) // self.bucket_size, (horizon.i_max + margin) // self.bucket_size + 1)
+        x_range = range((horizon.x_min - margin) // self.bucket_size, (horizon.x_max + margin) // self.bucket_size + 1)
+        return list(product(i_range, x_range))
+
+    def add(self, horizon):
+        """ Store horizon without attempts to merge it. """
+        key = id(horizon)
+        self.horizons[key] = horizon
+        self.numbers[key], self.counter = self.counter, self.counter + 1
+        self.keys[key] = self._bucket_keys(horizon, margin=self.adjacency)
+        for bucket in self.keys[key]:
+            self.buckets[bucket].add(key)
+
+    def remove(self, horizon):
+        """ Remove horizon from the index. Must be called before changing the horizon. """
+        key = id(horizon)
+        for bucket in self.keys.pop(key):
+            self.buckets[bucket].discard(key)
+        self.horizons.pop(key)
+        self.numbers.pop(key)
+
+    def _close(self, horizon, other):
+        """ Whether bounding boxes and depth ranges of two horizons are within merging distance. """
+        i_gap = max(horizon.i_min, other.i_min) - min(horizon.i_max, other.i_max) - 1
+        x_gap = max(horizon.x_min, other.x_min) - min(horizon.x_max, other.x_max) - 1
+        h_gap = max(horizon.h_min, other.h_min) - min(horizon.h_max, other.h_max)
+        return i_gap < self.adjacency and x_gap < self.adjacency and h_gap < self.mean_threshold
+
+    def candidates(self, horizon):
+        """ Stored horizons, that are close enough to `horizon` to be merged with it, in order of addition. """
+        keys = set()
+        for bucket in self._bucket_keys(horizon):
+            keys.update(self.buckets.get(bucket, ()))
+
+        return [self.horizons[key] for key in sorted(keys, key=self.numbers.get)
+                if self._close(horizon, self.horizons[key])]
+
+    def pairs(self):
+        """ Pairs of keys of stored horizons, that are close enough to be merged, in order of addition. """
+        result = set()
+        for keys in self.buckets.values():
+            keys = sorted(keys, key=self.numbers.get)
+            for i, key in enumerate(keys):
+                for other in keys[i + 1:]:
+                    if self._close(self.horizons[key], self.horizons[other]):
+                        result.add((key, other))
+        return sorted(result, key=lambda pair: (self.numbers[pair[0]], self.numbers[pair[1]]))
+
+    def _merge_pair(self, horizon, other):
+        """ Merge `other` into `horizon` in-place, if possible. """
+        merge_code, _ = Horizon.verify_merge(horizon, other, mean_threshold=self.mean_threshold,
+                                             adjacency=self.adjacency)
+        if merge_code == 3:
+            return Horizon.overlap_merge(horizon, other, inplace=True)
+        if merge_code == 2:
+            return Horizon.adjacent_merge(horizon, other, inplace=True,
+                                          mean_threshold=self.mean_threshold, adjacency=self.adjacency)
+        return False
+
+    def merge(self, horizon):
+        """ Merge horizon to the stored horizons, if possible; otherwise, store it as is.
+        Each of the candidates is checked once: the first one to merge with `horizon` absorbs it, and the following
+        candidates are merged into that grown horizon, so `horizon` can join multiple stored ones.
+
+        Returns
+        -------
+        Horizon
+            Stored horizon that contains `horizon`.
+        """
+        root = horizon
+        for other in self.candidates(horizon):
+            # Older horizon absorbs the newer one; changed horizon is re-registered in buckets at the end
+            first, second = (other, horizon) if root is horizon else (root, other)
+            if self._merge_pair(first, second):
+                self.remove(other)
+                root = first
+        self.add(root)
+        return root
+
+    def merge_stored(self):
+        """ Merge stored horizons with each other in one pass over pairs of close horizons.
+        Merged horizons are tracked with union-find: each pair is checked once on the horizons that currently
+        contain its members, and the older of them absorbs the newer one.
+        """
+        parents = {key: key for key in self.horizons}
+
+        def find(key):
+            while parents[key] != key:
+                parents[key] = parents[parents[key]]
+                key = parents[key]
+            return key
+
+        for first, second in self.pairs():
+            first, second = sorted((find(first), find(second)), key=self.numbers.get)
+            if first != second and self._merge_pair(self.horizons[first], self.horizons[second]):
+                parents[second] = first
+
+        # Re-register remaining horizons, as their bounding boxes have changed
+        horizons = list(self)
+        for horizon in horizons:
+            self.remove(horizon)
+        for horizon in horizons:
+            if find(id(horizon)) == id(horizon):
+                self.add(horizon)
+        return self
+
+
 @njit
 def _filtering_function(points, filtering_matrix):
     #pylint: disable=consider-using-enumerate
@@ -1658,3 +2002,117 @@ def _filtering_function(points, filtering_matrix):
         if filtering_matrix[il, xl] == 1:
             mask[i] = 0
     return points[mask == 1, :]
+
+# Offsets to the neighbours of a voxel (with full connectivity) that precede it in (iline, xline, height) order
+_PRECEDING_OFFSETS = np.array([(di, dx, dh) for di in (-1, 0) for dx in (-1, 0, 1) for dh in (-1, 0, 1)
+                               if (di, dx, dh) < (0, 0, 0)], dtype=np.int64)
+
+@njit
+def _find_root(parents, node):
+    """ Root of a node in union-find forest, with path halving. """
+    while parents[node] != node:
+        parents[node] = parents[parents[node]]
+        node = parents[node]
+    return node
+
+@njit
+def _merge_preceding(labels, parents, i, x, h):
+    """ Unite labels of already visited neighbours of a voxel. Return their root or 0, if there are none. """
+    current = 0
+    for k in range(len(_PRECEDING_OFFSETS)):
+        i_, x_, h_ = i + _PRECEDING_OFFSETS[k, 0], x + _PRECEDING_OFFSETS[k, 1], h + _PRECEDING_OFFSETS[k, 2]
+        if i_ < 0 or x_ < 0 or x_ >= labels.shape[1] or h_ < 0 or h_ >= labels.shape[2]:
+            continue
+
+        neighbour = labels[i_, x_, h_]
+        if neighbour != 0:
+            neighbour = _find_root(parents, neighbour)
+            if current == 0:
+                current = neighbour
+            elif neighbour != current:
+                current, other = min(current, neighbour), max(current, neighbour)
+                parents[other] = current
+    return current
+
+@njit
+def _label_regions(mask, threshold):
+    """ Label connected regions of voxels of the mask that are not less than `threshold`, in one pass.
+    Same as `skimage.measure.label` of the thresholded mask with full connectivity, but without
+    a boolean copy of the mask, and with labels stored as int32.
+
+    Returns
+    -------
+    tuple of np.ndarray and int
+        Labels, consecutive in order of the first voxel of each region, and the number of regions.
+    """
+    n_i, n_x, n_h = mask.shape
+    labels = np.zeros(mask.shape, dtype=np.int32)
+
+    # Voxels that start new provisional labels are never adjacent, so there are no more than that many of them
+    parents = np.zeros(((n_i + 1) // 2) * ((n_x + 1) // 2) * ((n_h + 1) // 2) + 1, dtype=np.int32)
+    counter = 0
+
+    for i in range(n_i):
+        for x in range(n_x):
+            for h in range(n_h):
+                if mask[i, x, h] >= threshold:
+                    current = _merge_preceding(labels, parents, i, x, h)
+                    if current == 0:
+                        counter += 1
+                        parents[counter] = current = counter
+                    labels[i, x, h] = current
+
+    # Replace provisional labels with consecutive ones in order of the first voxel of each region
+    final = np.zeros(counter + 1, dtype=np.int32)
+    num_labels = 0
+    for i in range(n_i):
+        for x in range(n_x):
+            for h in range(n_h):
+                if labels[i, x, h] != 0:
+                    root = _find_root(parents, labels[i, x, h])
+                    if final[root] == 0:
+                        num_labels += 1
+                        final[root] = num_labels
+                    labels[i, x, h] = final[root]
+    return labels, num_labels
+
+@njit(parallel=True)
+def _group_regions(coords, starts, ends, mode):
+    """ Reduce voxels of each region, sorted by (iline, xline), to one point for each (iline, xline).
+    Regions are located between `starts` and `ends` of `coords`. Height of the point is either
+    mean (`mode` is 0), min (1) or max (2) of heights of voxels.
+
+    Returns
+    -------
+    tuple of two np.ndarrays
+        Points of all regions and positions of points of each of them in the first array.
+    """
+    n = len(starts)
+    counts = np.zeros(n, dtype=np.int64)
+    for k in prange(n):
+        for j in range(starts[k], ends[k]):
+            if j == starts[k] or coords[j, 0] != coords[j - 1, 0] or coords[j, 1] != coords[j - 1, 1]:
+                counts[k] += 1
+
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(counts)
+    output = np.empty((offsets[-1], 3), dtype=coords.dtype)
+
+    for k in prange(n):
+        position, value, count = offsets[k] - 1, 0, 0
+        for j in range(starts[k], ends[k]):
+            height = coords[j, 2]
+            if j == starts[k] or coords[j, 0] != coords[j - 1, 0] or coords[j, 1] != coords[j - 1, 1]:
+                position += 1
+                output[position, 0], output[position, 1] = coords[j, 0], coords[j, 1]
+                value, count = height, 1
+            else:
+                count += 1
+                if mode == 0:
+                    value += height
+                elif mode == 1:
+                    value = min(value, height)
+                else:
+                    value = max(value, height)
+            output[position, 2] = value // count if mode == 0 else value
+    return output, offsets
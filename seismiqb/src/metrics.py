@@ -2,6 +2,7 @@
 #pylint: disable=too-many-lines, not-an-iterable
 from copy import copy
 from textwrap import dedent
+from warnings import warn
 from tqdm.auto import tqdm
 
 import numpy as np
@@ -572,6 +573,8 @@ class HorizonMetrics(BaseSeismicMetric):
         or sequence of two horizons, then they are compared against each other,
         or nested sequence of horizon and list of horizons, then the first horizon is compared against the
         best match from the list.
+    chunk_size : int, optional
+        Deprecated: use `tile_memory` instead.
     other parameters
         Passed direcly to :meth:`.Horizon.get_cube_values` or :meth:`.Horizon.get_cube_values_line`.
     """
@@ -586,15 +589,21 @@ class HorizonMetrics(BaseSeismicMetric):
         'hilbert', 'instantaneous_phase',
     ]
 
-    def __init__(self, horizons, orientation=None, window=23, offset=0, scale=False, chunk_size=256, line=1):
+    def __init__(self, horizons, orientation=None, window=23, offset=0, scale=False, tile_memory=256*1024**2,
+                 line=1, chunk_size=None):
         super().__init__()
         horizons = list(horizons) if isinstance(horizons, tuple) else horizons
         horizons = horizons if isinstance(horizons, list) else [horizons]
         self.horizons = horizons
 
+        if chunk_size is not None:
+            # Data was read in chunks of `chunk_size` depths over the whole bounding box of the horizon
+            warn('`chunk_size` is deprecated, use `tile_memory` instead', DeprecationWarning, stacklevel=2)
+            tile_memory = chunk_size * horizons[0].i_length * horizons[0].x_length * 4
+
         # Save parameters for later evaluation
         self.orientation, self.line = orientation, line
-        self.window, self.offset, self.scale, self.chunk_size = window, offset, scale, chunk_size
+        self.window, self.offset, self.scale, self.tile_memory = window, offset, scale, tile_memory
 
         # The first horizon is used to evaluate metrics
         self.horizon = horizons[0]
@@ -619,7 +628,7 @@ class HorizonMetrics(BaseSeismicMetric):
         """ Create `data` attribute at the first time of evaluation. """
         if self._data is None:
             self._data = self.horizon.get_cube_values(window=self.window, offset=self.offset,
-                                                      scale=self.scale, chunk_size=self.chunk_size)
+                                                      scale=self.scale, tile_memory=self.tile_memory)
         self._data[self._data == Horizon.FILL_VALUE] = np.nan
         return self._data
 
@@ -638,15 +647,20 @@ class HorizonMetrics(BaseSeismicMetric):
         return self._probs
 
     def instantaneous_phase(self, **kwargs):
-        """ Compute instantaneous phase via Hilbert transform. """
-        #pylint: disable=unexpected-keyword-arg
-        analytic = hilbert(self.data, axis=2)
-
-        phase = np.angle(analytic)
-        phase = phase % (2 * np.pi) - np.pi
-
-        phase_slice = phase[:, :, phase.shape[-1] // 2]
-        phase_slice[np.isnan(np.std(self.data, axis=-1))] = np.nan
+        """ Compute instantaneous phase via Hilbert transform.
+        Phase of each trace depends only on its own values: unless `data` is already loaded, it is computed on tiles
+        of cube values along the horizon, so the whole `data` array is never created.
+        """
+        if self._data is not None or not self.spatial:
+            phase_slice = self._instantaneous_phase(self.data)
+        else:
+            # Traces without horizon have zero values, and, therefore, phase of -pi
+            phase_slice = np.full(self.horizon.cube_shape[:2], -np.pi)
+            for (slice_i, slice_x), values in self.horizon.iterate_cube_values(window=self.window, offset=self.offset,
+                                                                               scale=self.scale,
+                                                                               tile_memory=self.tile_memory):
+                phase_slice[slice_i, slice_x] = self._instantaneous_phase(values)
+            phase_slice[self.horizon.geometry.zero_traces == 1] = np.nan
 
         avg = mode_scipy(phase_slice[~np.isnan(phase_slice)].round(2), None)
         phase_slice -= avg[0][0]
@@ -665,6 +679,19 @@ class HorizonMetrics(BaseSeismicMetric):
         return phase_slice, plot_dict
 
 
+    @staticmethod
+    def _instantaneous_phase(data):
+        """ Instantaneous phase at the center of each trace of `data`. """
+        #pylint: disable=unexpected-keyword-arg
+        analytic = hilbert(data, axis=2)
+
+        phase = np.angle(analytic)
+        phase = phase % (2 * np.pi) - np.pi
+
+        phase_slice = phase[:, :, phase.shape[-1] // 2]
+        phase_slice[np.isnan(np.std(data, axis=-1))] = np.nan
+        return phase_slice
+
     def find_best_match(self, offset=0, **kwargs):
         """ Find the closest horizon to the first one in the list of passed at initialization. """
         _ = kwargs
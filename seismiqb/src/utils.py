@@ -1,14 +1,18 @@
 """ Utility functions. """
+import os
 from math import isnan
 from collections import OrderedDict
-from threading import RLock
+from threading import RLock, Event
 from functools import wraps
+from contextlib import contextmanager
 from hashlib import blake2b
+from concurrent.futures import ThreadPoolExecutor
 
 from tqdm import tqdm
 import numpy as np
 import pandas as pd
 import segyio
+import h5py
 
 from numba import njit, prange
 
@@ -192,6 +196,535 @@ class lru_cache:
         return wrapper
 
 
+class SlideCache:
+    """ Thread-safe least recent used cache of arrays, bounded by their total size in bytes.
+    Keys are made of the `owner` (usually, path to the cube), `projection` and `loc`, so that
+    one instance can be shared between multiple geometries.
+
+    Concurrent requests of the same item are loaded only once: other threads wait for the first one to finish.
+    That allows to warm up the cache in background threads while the same items are requested from the main one.
+
+    Parameters
+    ----------
+    maxbytes : int
+        Memory budget of the cache. Least recently used items are evicted until the new one fits in;
+        items, larger than the whole budget, are not stored at all.
+
+    Examples
+    --------
+    Share one cache between geometries::
+
+    cache = SlideCache(maxbytes=8 * 1024**3)
+    for geometry in geometries:
+        geometry.slide_cache = cache
+    """
+    DEFAULT_SIZE = 1024 ** 3
+
+    def __init__(self, maxbytes=DEFAULT_SIZE):
+        self.maxbytes = maxbytes
+        self.lock = RLock()
+        self.reset()
+
+    def reset(self, owner=None):
+        """ Clear cache and stats: either completely or only items of the `owner`. """
+        with self.lock:
+            if owner is None:
+                self.cache = OrderedDict()
+                self.pending = {}
+                self.nbytes = 0
+                self.stats = {}
+            else:
+                for key in [key for key in self.cache if key[0] == owner]:
+                    self._pop(key)
+                self.stats.pop(owner, None)
+
+    def get(self, owner, projection, loc, loader):
+        """ Retrieve item from the cache, if it is there. Otherwise, evaluate `loader` and store its result. """
+        key = (owner, projection, loc)
+
+        while True:
+            # If result is already in cache, just retrieve it and update its timings
+            with self.lock:
+                result = self.cache.get(key)
+                if result is not None:
+                    self.cache.move_to_end(key)
+                    self._owner_stats(owner)['hit'] += 1
+                    return result
+
+                # If the same item is being loaded by other thread, wait for it and check again
+                event = self.pending.get(key)
+                if event is None:
+                    event = self.pending[key] = Event()
+                    break
+            event.wait()
+
+        # The result was not found in cache: evaluate function
+        try:
+            result = loader()
+
+            # Add the result to cache
+            with self.lock:
+                self._owner_stats(owner)['miss'] += 1
+                self.put(key, result)
+        finally:
+            with self.lock:
+                self.pending.pop(key, None)
+            event.set()
+        return result
+
+    def put(self, key, value):
+        """ Store `value`, evicting the least recently used items to fit in the memory budget. """
+        size = value.nbytes
+        with self.lock:
+            if key in self.cache or size > self.maxbytes:
+                return
+            while self.nbytes + size > self.maxbytes:
+                evicted = self._pop(next(iter(self.cache)))
+                self._owner_stats(evicted)['evicted'] += 1
+
+            self.cache[key] = value
+            self.nbytes += size
+            stats = self._owner_stats(key[0])
+            stats['items'] += 1
+            stats['nbytes'] += size
+
+    def resize(self, maxbytes):
+        """ Change memory budget, evicting items, if needed. """
+        with self.lock:
+            self.maxbytes = maxbytes
+            while self.nbytes > self.maxbytes:
+                evicted = self._pop(next(iter(self.cache)))
+                self._owner_stats(evicted)['evicted'] += 1
+
+    def info(self, owner=None):
+        """ Stats of hits, misses, evictions, amount of stored items and their size: either overall or of `owner`. """
+        with self.lock:
+            if owner is not None:
+                return dict(self._owner_stats(owner))
+
+            total = {'hit': 0, 'miss': 0, 'evicted': 0, 'items': 0, 'nbytes': 0}
+            for stats in self.stats.values():
+                for key, value in stats.items():
+                    total[key] += value
+            return total
+
+    def _owner_stats(self, owner):
+        if owner not in self.stats:
+            self.stats[owner] = {'hit': 0, 'miss': 0, 'evicted': 0, 'items': 0, 'nbytes': 0}
+        return self.stats[owner]
+
+    def _pop(self, key):
+        value = self.cache.pop(key)
+        self.nbytes -= value.nbytes
+
+        stats = self._owner_stats(key[0])
+        stats['items'] -= 1
+        stats['nbytes'] -= value.nbytes
+        return key[0]
+
+    def __contains__(self, key):
+        return key in self.cache
+
+    def __len__(self):
+        return len(self.cache)
+
+    def __getstate__(self):
+        # Stored arrays are not sent to other processes: the cache is warmed up there anew
+        return {'maxbytes': self.maxbytes}
+
+    def __setstate__(self, state):
+        self.__init__(state['maxbytes'])
+
+
+class BufferPool:
+    """ Reusable preallocated arrays, keyed by shape and dtype.
+    Buffer, handed out by :meth:`.get`, is in use until it is given back by :meth:`.release`: only then it can be
+    handed out again. Buffers can also be taken for a block of code with :meth:`.buffer` context manager.
+
+    Parameters
+    ----------
+    maxsize : int
+        Maximum amount of stored free buffers for each combination of shape and dtype.
+    """
+    def __init__(self, maxsize=4):
+        self.maxsize = maxsize
+        self.lock = RLock()
+        self.reset()
+
+    def reset(self):
+        """ Drop all of the stored buffers. """
+        self.buffers = {}
+        self.in_use = {}
+        self.stats = {'reused': 0, 'allocated': 0}
+
+    def get(self, shape, dtype=np.float32):
+        """ Free buffer of desired shape and dtype. Its contents are undefined. """
+        key = (tuple(shape), np.dtype(dtype).str)
+        with self.lock:
+            buffers = self.buffers.setdefault(key, [])
+            if buffers:
+                buffer = buffers.pop()
+                self.stats['reused'] += 1
+            else:
+                buffer = np.empty(shape, dtype=dtype)
+                self.stats['allocated'] += 1
+            self.in_use[id(buffer)] = key
+            return buffer
+
+    def release(self, buffer):
+        """ Give `buffer` back to the pool. It must not be used afterwards. """
+        with self.lock:
+            key = self.in_use.pop(id(buffer), None)
+            if key is not None:
+                buffers = self.buffers.setdefault(key, [])
+                if len(buffers) < self.maxsize:
+                    buffers.append(buffer)
+
+    @contextmanager
+    def buffer(self, shape, dtype=np.float32):
+        """ Buffer of desired shape and dtype, that is released at the exit from the context. """
+        buffer = self.get(shape, dtype)
+        try:
+            yield buffer
+        finally:
+            self.release(buffer)
+
+
+
+class Accumulator3D:
+    """ Aggregation of crops into one 3D array, crop by crop or batch by batch, so that
+    the whole list of crops is never needed at once.
+    Aggregated values can be kept either in memory, in `.npy` files through `np.memmap` or in a chunked HDF5 dataset.
+    In any case, they are retrieved by slicing the instance, so it can be used in place of an array, for example,
+    by :meth:`.Horizon.from_mask` with `chunk_size`.
+
+    Batches of crops of the same shape are added to in-memory or memory mapped `float32` arrays by one
+    jit-compiled kernel; otherwise, crops are added one by one.
+
+    Parameters
+    ----------
+    shape : sequence of three ints
+        Shape of the aggregated array.
+    origin : sequence of three ints
+        Location of the aggregated array in the cube: it is subtracted from locations of crops.
+    aggregation : str
+        If `max`, then maximum of overlapping crops is kept.
+        If `mean`, then overlapping crops are averaged.
+        If `weighted`, then overlapping crops are averaged with weights from `window`: sums of weighted values
+        and of weights are kept.
+    window : str or np.ndarray
+        Weights of points of a crop for `weighted` aggregation. If `gaussian` or `cosine`, then weights decrease from
+        the center of a crop to its borders as such function does along each axis. If array, then it must be
+        of the crops shape.
+    dtype : dtype
+        Type of the aggregated array and of the sum of weights.
+    fill_value : number
+        Value for points without crops in `max` aggregation.
+    path : str, optional
+        If ends with `.hdf5` or `.h5`, then values are stored in a chunked HDF5 dataset in this file.
+        If any other string, then values are stored in `.npy` file, which is memory mapped.
+        If None, then values are stored in memory.
+    """
+    def __init__(self, shape, origin=(0, 0, 0), aggregation='max', window='gaussian', dtype=np.float32,
+                 fill_value=0, path=None):
+        if aggregation not in ['max', 'mean', 'weighted']:
+            raise ValueError(f'Unknown aggregation `{aggregation}`.')
+        self.shape, self.origin = tuple(shape), np.array(origin)
+        self.aggregation, self.dtype = aggregation, dtype
+        self.window, self.windows = window, {}
+        self.path, self.file = path, None
+
+        fill_value = fill_value if aggregation == 'max' else 0
+        self.data = self._create('data', dtype, fill_value)
+        self.weights = self._create('weights', dtype, 0) if aggregation != 'max' else None
+
+    def _create(self, name, dtype, fill_value):
+        """ Array of the accumulator shape in the desired storage. """
+        if self.path is None:
+            return np.full(self.shape, fill_value, dtype=dtype)
+
+        if os.path.splitext(self.path)[1] in ['.hdf5', '.h5']:
+            if self.file is None:
+                self.file = h5py.File(self.path, mode='w')
+            return self.file.create_dataset(name, shape=self.shape, dtype=dtype, chunks=True, fillvalue=fill_value)
+
+        path = self.path if name == 'data' else f'{os.path.splitext(self.path)[0]}_{name}.npy'
+        array = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=self.shape)
+        if fill_value != 0:
+            array[:] = fill_value
+        return array
+
+    def get_window(self, crop_shape):
+        """ Weights of points of a crop of `crop_shape`. """
+        crop_shape = tuple(crop_shape)
+        if crop_shape not in self.windows:
+            if self.aggregation == 'mean':
+                window = np.ones(crop_shape, dtype=np.float32)
+            elif isinstance(self.window, np.ndarray):
+                window = self.window.astype(np.float32)
+            else:
+                window = np.ones(crop_shape, dtype=np.float32)
+                for axis, size in enumerate(crop_shape):
+                    # Centers of points in [-1, 1] range along the axis
+                    positions = (np.arange(size, dtype=np.float32) + 0.5) / size * 2 - 1
+                    if self.window == 'gaussian':
+                        weights = np.exp(-positions ** 2 / (2 * 0.5 ** 2))
+                    elif self.window == 'cosine':
+                        weights = np.cos(positions * np.pi / 2)
+                    else:
+                        raise ValueError(f'Unknown window `{self.window}`.')
+                    window *= weights.reshape([-1 if i == axis else 1 for i in range(3)])
+            self.windows[crop_shape] = window
+        return self.windows[crop_shape]
+
+    def locate(self, location, crop_shape):
+        """ Slices of the accumulator and of the crop, cut at the borders of the accumulator. """
+        starts = [slc.start - shift for slc, shift in zip(location, self.origin)]
+        stops = [min(start + size, limit) for start, size, limit in zip(starts, crop_shape, self.shape)]
+
+        crop_starts = [max(-start, 0) for start in starts]
+        starts = [max(start, 0) for start in starts]
+        if any(start >= stop for start, stop in zip(starts, stops)):
+            return None, None
+        return (tuple(slice(start, stop) for start, stop in zip(starts, stops)),
+                tuple(slice(crop_start, crop_start + stop - start)
+                      for crop_start, start, stop in zip(crop_starts, starts, stops)))
+
+    def update(self, crop, location):
+        """ Add `crop` to the accumulator.
+
+        Parameters
+        ----------
+        crop : np.ndarray
+            Values to add.
+        location : sequence of three slices
+            Location of the crop in the cube.
+        """
+        slices, crop_slices = self.locate(location, crop.shape)
+        if slices is None:
+            return
+
+        if self.aggregation == 'max':
+            self.data[slices] = np.maximum(self.data[slices], crop[crop_slices])
+        else:
+            window = self.get_window(crop.shape)[crop_slices]
+            self.data[slices] = self.data[slices] + crop[crop_slices] * window
+            self.weights[slices] = self.weights[slices] + window
+
+    def update_batch(self, crops, locations):
+        """ Add multiple crops to the accumulator.
+
+        Parameters
+        ----------
+        crops : np.ndarray or sequence of np.ndarrays
+            Values to add.
+        locations : sequence
+            Location of each crop in the cube, as three slices.
+        """
+        shapes = {crop.shape for crop in crops}
+        if (len(shapes) == 1 and isinstance(self.data, np.ndarray)
+                and np.dtype(self.dtype) in [np.float32, np.float64]):
+            crops = np.asarray(crops, dtype=self.dtype)
+            starts = np.array([[slc.start for slc in location] for location in locations]) - self.origin
+
+            if self.aggregation == 'max':
+                window, weights = np.empty((1, 1, 1), dtype=np.float32), np.empty((1, 1, 1), dtype=self.dtype)
+            else:
+                window, weights = self.get_window(shapes.pop()), self.weights.view(np.ndarray)
+            _scatter_crops(self.data.view(np.ndarray), weights, crops, starts, window, self.aggregation == 'max')
+        else:
+            for crop, location in zip(crops, locations):
+                self.update(crop, location)
+
+    def __getitem__(self, key):
+        """ Aggregated values in `key` location of the accumulator. """
+        if self.aggregation == 'max':
+            return np.asarray(self.data[key])
+        weights = np.asarray(self.weights[key])
+        data = np.asarray(self.data[key], dtype=np.float32)
+        return np.divide(data, weights, out=np.zeros_like(data), where=weights > 0)
+
+    def aggregate(self):
+        """ Aggregated values as one array in memory. """
+        return self[:, :, :]
+
+    def remove(self):
+        """ Close and delete files of the accumulator. """
+        if self.path is None:
+            return
+        if self.file is not None:
+            self.file.close()
+            paths = [self.path]
+        else:
+            paths = [array.filename for array in [self.data, self.weights] if array is not None]
+
+        self.data, self.weights, self.file = None, None, None
+        for path in paths:
+            os.remove(path)
+
+@njit(parallel=True)
+def _scatter_crops(data, weights, crops, starts, window, use_max):
+    """ Add `crops`, located at `starts`, to `data`: either by maximum, or as weighted sums with weights from `window`.
+    Crops are added one after another, while ilines of each crop are processed in parallel, so that no point
+    is updated from multiple threads at once.
+    """
+    for k in range(len(crops)):
+        i_start, x_start, h_start = starts[k]
+        for i in prange(crops.shape[1]):
+            i_ = i_start + i
+            if i_ < 0 or i_ >= data.shape[0]:
+                continue
+            for x in range(crops.shape[2]):
+                x_ = x_start + x
+                if x_ < 0 or x_ >= data.shape[1]:
+                    continue
+                for h in range(crops.shape[3]):
+                    h_ = h_start + h
+                    if h_ < 0 or h_ >= data.shape[2]:
+                        continue
+
+                    value = crops[k, i, x, h]
+                    if use_max:
+                        data[i_, x_, h_] = max(data[i_, x_, h_], value)
+                    else:
+                        data[i_, x_, h_] += value * window[i, x, h]
+                        weights[i_, x_, h_] += window[i, x, h]
+
+
+
+class ChunkedAccumulator3D:
+    """ Aggregation of a stream of crops into chunks along one axis, so that only the chunks, that can still be
+    touched by crops, are kept in memory. Crops must come in the non-decreasing order of their starts along `axis`:
+    for example, from the grid of :meth:`~.SeismicCubeset.make_grid` with appropriate `order`.
+
+    Each chunk is a separate :class:`.Accumulator3D`, and every crop is added to each of the chunks it intersects.
+    As soon as a crop starts after the end of a chunk, no later crop can touch it: aggregated values of the chunk
+    are passed to `callback` and the chunk is released.
+
+    Parameters
+    ----------
+    shape : sequence of three ints
+        Shape of the whole aggregated region.
+    origin : sequence of three ints
+        Location of the aggregated region in the cube.
+    axis : int
+        Axis to split the region into chunks along.
+    chunk_size : int
+        Length of chunks along `axis`.
+    chunk_step : int, optional
+        Distance between starts of successive chunks. If less than `chunk_size`, then chunks overlap.
+        Default is `chunk_size`.
+    callback : callable
+        Applied to aggregated values of each finished chunk and its location in the cube as sequence of three ints.
+    background : bool
+        Whether to apply `callback` in a separate thread, while the next crops are added.
+        At most one chunk is processed at a time, so `callback` is not required to be thread-safe.
+    kwargs : dict
+        Other parameters of chunk accumulators: `aggregation`, `window`, `dtype` and `fill_value`.
+    """
+    def __init__(self, shape, origin=(0, 0, 0), axis=0, chunk_size=100, chunk_step=None, callback=None,
+                 background=True, **kwargs):
+        self.shape, self.origin, self.axis = tuple(shape), np.array(origin), axis
+        self.callback, self.kwargs = callback, kwargs
+
+        chunk_step = chunk_step or chunk_size
+        self.chunk_starts = [0]
+        while self.chunk_starts[-1] + chunk_size < self.shape[axis]:
+            self.chunk_starts.append(self.chunk_starts[-1] + chunk_step)
+        self.chunk_stops = [min(start + chunk_size, self.shape[axis]) for start in self.chunk_starts]
+
+        self.accumulators = {}
+        self.n_flushed = 0
+        self.executor = ThreadPoolExecutor(max_workers=1) if background else None
+        self.future = None
+
+    def chunk_origin(self, idx):
+        """ Location of the `idx`-th chunk in the cube. """
+        origin = self.origin.copy()
+        origin[self.axis] += self.chunk_starts[idx]
+        return origin
+
+    def update_batch(self, crops, locations):
+        """ Add multiple crops to the chunks they intersect, then process the chunks, that are finished.
+
+        Parameters
+        ----------
+        crops : np.ndarray or sequence of np.ndarrays
+            Values to add.
+        locations : sequence
+            Location of each crop in the cube, as three slices.
+        """
+        starts = np.array([location[self.axis].start for location in locations]) - self.origin[self.axis]
+        stops = np.array([location[self.axis].stop for location in locations]) - self.origin[self.axis]
+
+        for idx in range(self.n_flushed, len(self.chunk_starts)):
+            if self.chunk_starts[idx] >= stops.max():
+                break
+            mask = (starts < self.chunk_stops[idx]) & (stops > self.chunk_starts[idx])
+            if not mask.any():
+                continue
+
+            if idx not in self.accumulators:
+                shape = list(self.shape)
+                shape[self.axis] = self.chunk_stops[idx] - self.chunk_starts[idx]
+                self.accumulators[idx] = Accumulator3D(shape, origin=self.chunk_origin(idx), **self.kwargs)
+            self.accumulators[idx].update_batch([crop for crop, flag in zip(crops, mask) if flag],
+                                                [location for location, flag in zip(locations, mask) if flag])
+
+        self.flush(frontier=starts.max())
+
+    def update(self, crop, location):
+        """ Add `crop` at `location` to the chunks it intersects. """
+        self.update_batch([crop], [location])
+
+    def flush(self, frontier=None):
+        """ Pass finished chunks to `callback` in order.
+
+        Parameters
+        ----------
+        frontier : int, optional
+            Start of the next crops along `axis`, relative to `origin`: chunks, that end before it, are finished.
+            If None, then all of the remaining chunks are finished.
+        """
+        while self.n_flushed < len(self.chunk_starts):
+            if frontier is not None and self.chunk_stops[self.n_flushed] > frontier:
+                break
+
+            accumulator = self.accumulators.pop(self.n_flushed, None)
+            if accumulator is not None:
+                self._process(accumulator.aggregate(), self.chunk_origin(self.n_flushed))
+            self.n_flushed += 1
+
+    def _process(self, array, origin):
+        """ Apply `callback` to the chunk, waiting for the previous one to be done first. """
+        if self.executor is None:
+            self.callback(array, origin)
+        else:
+            self.wait()
+            self.future = self.executor.submit(self.callback, array, origin)
+
+    def wait(self):
+        """ Wait for processing of the last finished chunk. Re-raises exceptions from `callback`. """
+        if self.future is not None:
+            future, self.future = self.future, None
+            future.result()
+
+    def finalize(self):
+        """ Process all of the remaining chunks and wait for it to end. """
+        self.flush()
+        self.close()
+
+    def close(self):
+        """ Wait for processing of the last finished chunk and stop the background thread.
+        Remaining chunks are not processed. Re-raises exceptions from `callback`.
+        """
+        try:
+            self.wait()
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+
 
 #TODO: rethink
 def make_subcube(path, geometry, path_save, i_range, x_range):
@@ -372,37 +905,147 @@ def gen_crop_coordinates(point, horizon_matrix, zero_traces,
                 orders_array[top])
 
 
-@njit
-def groupby_mean(array):
-    """ Faster version of mean-groupby of data along the first two columns.
-    Input array is supposed to have (N, 3) shape.
-    """
-    n = len(array)
+def read_point_cloud(path, usecols, cache=False):
+    """ Load columns of a whitespace-separated point cloud file, for example, a horizon in CHARISMA format.
+    File is read as a whole into memory and its lines are parsed in parallel by a jit-compiled function,
+    so only the requested columns are converted to numbers. Lines with missing or non-numeric values are skipped.
 
-    output = np.zeros_like(array)
-    position = 0
+    Parameters
+    ----------
+    path : str
+        Path to file with point cloud.
+    usecols : sequence of ints
+        Positions of columns to load.
+    cache : bool
+        Whether to save loaded values to a hidden `.npz` file next to the original one, and to
+        load them from it, if the original file has not changed since (checked by its size and modification time).
+        Each column is stored in the smallest of `int32`, `float32` and `float64` types that keeps its values exact:
+        for example, ilines and xlines are stored as `int32`.
 
-    prev = array[0, :2]
-    s, c = array[0, -1], 1
+    Returns
+    -------
+    np.ndarray
+        Array of `(n_lines, len(usecols))` shape with float values.
+    """
+    usecols = np.array(usecols, dtype=np.int64)
+    stat = os.stat(path)
+    cache_path = os.path.join(os.path.dirname(path), f'.{os.path.basename(path)}.npz')
+
+    if cache and os.path.exists(cache_path):
+        try:
+            with np.load(cache_path) as file:
+                if (file['mtime'] == stat.st_mtime and file['size'] == stat.st_size
+                        and np.array_equal(file['usecols'], usecols)):
+                    return np.stack([file[f'column_{k}'] for k in range(len(usecols))], axis=1).astype(np.float64)
+        except (OSError, KeyError, ValueError):
+            pass
+
+    data = np.fromfile(path, dtype=np.uint8)
+    newlines = np.flatnonzero(data == ord('\n'))
+    starts = np.concatenate([[0], newlines + 1])
+    ends = np.concatenate([newlines, [len(data)]])
+
+    points = _parse_point_cloud(data, starts, ends, usecols)
+    points = points[~np.isnan(points).any(axis=1)]
+
+    if cache:
+        try:
+            columns = {f'column_{k}': _compact_column(points[:, k]) for k in range(len(usecols))}
+            np.savez(cache_path, usecols=usecols, mtime=stat.st_mtime, size=stat.st_size, **columns)
+        except OSError:
+            pass
+    return points
+
+def _compact_column(values):
+    """ Convert `values` to the smallest of `int32`, `float32` and `float64` types, that represents them exactly. """
+    int32_info = np.iinfo(np.int32)
+    if (np.all(values == np.round(values))
+            and (len(values) == 0 or int32_info.min <= values.min() and values.max() <= int32_info.max)):
+        return values.astype(np.int32)
+    if np.all(values.astype(np.float32) == values):
+        return values.astype(np.float32)
+    return values
 
-    for i in range(1, n):
-        curr = array[i, :2]
+@njit(parallel=True)
+def _parse_point_cloud(data, starts, ends, usecols):
+    """ Parse columns `usecols` of each line, that is located between `starts` and `ends` of `data` bytes. """
+    result = np.full((len(starts), len(usecols)), np.nan)
+
+    for i in prange(len(starts)):
+        position, end, column = starts[i], ends[i], 0
+        while position < end:
+            # Skip whitespaces, then find the end of the token
+            while position < end and data[position] <= 32:
+                position += 1
+            token_start = position
+            while position < end and data[position] > 32:
+                position += 1
+            if token_start == position:
+                break
+
+            for k in range(len(usecols)): #pylint: disable=consider-using-enumerate
+                if usecols[k] == column:
+                    result[i, k] = _parse_float(data, token_start, position)
+            column += 1
+    return result
 
-        if prev[0] == curr[0] and prev[1] == curr[1]:
-            s += array[i, -1]
-            c += 1
+@njit
+def _parse_float(data, start, end):
+    """ Convert bytes between `start` and `end` to float. If they are not a number, return nan. """
+    sign, position = 1.0, start
+    if data[position] == 45 or data[position] == 43:
+        sign = -1.0 if data[position] == 45 else 1.0
+        position += 1
+
+    # Digits are accumulated into an integer: the decimal point only shifts the exponent.
+    # Only the first 18 significant digits fit into int64, so the following ones are dropped
+    mantissa, n_digits, n_significant, exponent, after_point = 0, 0, 0, 0, False
+    while position < end:
+        char = data[position]
+        if 48 <= char <= 57:
+            if n_significant < 18:
+                mantissa = mantissa * 10 + (char - 48)
+                if mantissa > 0:
+                    n_significant += 1
+                if after_point:
+                    exponent -= 1
+            elif not after_point:
+                exponent += 1
+            n_digits += 1
+        elif char == 46 and not after_point:
+            after_point = True
         else:
-            output[position, :2] = prev
-            output[position, -1] = s / c
-            position += 1
+            break
+        position += 1
 
-            prev = curr
-            s, c = array[i, -1], 1
+    if position < end and (data[position] == 69 or data[position] == 101):
+        value, position = _parse_exponent(data, position + 1, end)
+        exponent += value
 
-    output[position, :2] = prev
-    output[position, -1] = s / c
-    position += 1
-    return output[:position]
+    if n_digits == 0 or position != end:
+        return np.nan
+    if exponent < 0:
+        return sign * mantissa / 10.0 ** (-exponent)
+    return sign * mantissa * 10.0 ** exponent
+
+
+@njit
+def _parse_exponent(data, start, end):
+    """ Parse exponent of a float, starting right after `e`. Huge values are capped, as they make inf or zero anyway.
+
+    Returns
+    -------
+    tuple of two ints
+        Value of the exponent and position after it.
+    """
+    sign, value, position = 1, 0, start
+    if position < end and (data[position] == 45 or data[position] == 43):
+        sign = -1 if data[position] == 45 else 1
+        position += 1
+    while position < end and 48 <= data[position] <= 57:
+        value = min(value * 10 + (data[position] - 48), 100000)
+        position += 1
+    return sign * value, position
 
 
 @njit